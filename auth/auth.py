@@ -2,8 +2,9 @@ import json
 from flask import abort, request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
 import os
+from auth.jwks import JWKSCache
+from auth.tokens import create_token_cache
 
 
 AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN")
@@ -67,7 +68,7 @@ def get_token_auth_header():
 Check / Validate Permissions
     @INPUTS
         permission: string permission (i.e. 'post:drink')
-        payload:    Decoded json object. 
+        payload:    Decoded json object, permissions as a list or a set
 '''
 def check_permissions(permission, payload):
     if "permissions" not in payload:
@@ -82,6 +83,35 @@ def check_permissions(permission, payload):
         }, 403)
     return True
 
+'''
+Signing keys (JWKS)
+    cached process wide, see auth/jwks.py. refresh=True is used when a token
+    names a key id the cached document does not have.
+'''
+jwks_cache = JWKSCache(
+    f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+    default_ttl=int(os.environ.get("JWKS_TTL", 600)),
+    min_refresh_interval=int(os.environ.get("JWKS_MIN_REFRESH_INTERVAL", 30)))
+
+def get_jwks(refresh=False):
+    if refresh:
+        return jwks_cache.refresh()
+    return jwks_cache.get()
+
+
+def find_rsa_key(jwks, kid):
+    for key in jwks['keys']:
+        if key['kid'] == kid:
+            return {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+    return {}
+
+
 '''
 Verify JWT Token
     @INPUTS
@@ -95,10 +125,7 @@ Verify JWT Token
 
 '''
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     payload = None
     if 'kid' not in unverified_header:
         raise AuthError({
@@ -106,15 +133,11 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = find_rsa_key(get_jwks(), unverified_header['kid'])
+    if not rsa_key:
+        # the signing keys may have been rotated since they were fetched
+        rsa_key = find_rsa_key(get_jwks(refresh=True),
+                               unverified_header['kid'])
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -149,6 +172,9 @@ def verify_decode_jwt(token):
                 'description': 'Unable to find the appropriate key.'
             }, 400)
 
+# claims of verified tokens until they expire, see auth/tokens.py
+token_cache = create_token_cache()
+
 '''
     @INPUTS
         permission: string permission (i.e. 'post:drink')
@@ -167,7 +193,8 @@ def requires_auth(permission=''):
                 return f("",*args, **kwargs)
             """ End of bypass"""
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
+            # repeat tokens come from the cache without signature checks
+            payload = token_cache.verify(token, verify_decode_jwt)
             check_permissions(permission, payload)
 
             return f(payload, *args, **kwargs)
@@ -0,0 +1,149 @@
+"""
+Process wide cache of the Auth0 signing keys (JWKS document).
+
+The document is kept for the max-age of its Cache-Control header (JWKS_TTL
+seconds when the header has none). Within its stale-while-revalidate window
+an expired document is still served while one background thread fetches the
+new one, so no request waits on Auth0. Past that window the next request
+fetches synchronously, and if Auth0 cannot be reached the last document is
+served rather than failing every write (retried at most once every
+JWKS_MIN_REFRESH_INTERVAL seconds).
+
+A token signed with a key id the document does not contain forces a
+refresh, at most once every JWKS_MIN_REFRESH_INTERVAL seconds, so tokens
+with made up key ids cannot make the API hammer Auth0.
+"""
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+
+'''
+parse_cache_control(header)
+    returns (max_age, stale_while_revalidate) in seconds, None when the
+    directive is absent. no-cache / no-store mean a max age of 0.
+'''
+def parse_cache_control(header):
+    max_age = None
+    stale_while_revalidate = None
+    for directive in (header or "").lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        try:
+            if name == "max-age":
+                max_age = int(value)
+            elif name == "stale-while-revalidate":
+                stale_while_revalidate = int(value)
+        except ValueError:
+            continue
+        if name in ("no-cache", "no-store"):
+            max_age = 0
+    return max_age, stale_while_revalidate
+
+
+class JWKSCache:
+    def __init__(self, url, default_ttl=600, min_refresh_interval=30,
+                 timeout=5, clock=time.monotonic):
+        self.url = url
+        self.default_ttl = default_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.clock = clock
+        self.jwks = None
+        self.fetched_at = None
+        self.max_age = default_ttl
+        self.stale_while_revalidate = 0
+        self.last_attempt = None
+        self.revalidating = False
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+        self.hits = 0
+        self.fetches = 0
+        self.errors = 0
+
+    def get(self):
+        if self.jwks is None:
+            return self.fetch()
+        age = self.clock() - self.fetched_at
+        if age < self.max_age:
+            self.hits += 1
+            return self.jwks
+        if age < self.max_age + self.stale_while_revalidate:
+            self.hits += 1
+            self.revalidate_in_background()
+            return self.jwks
+        if self.recently_attempted():
+            # fetched or failed moments ago, keep serving the old keys
+            return self.jwks
+        return self.fetch()
+
+    def recently_attempted(self):
+        return self.last_attempt is not None and \
+            self.clock() - self.last_attempt < self.min_refresh_interval
+
+    '''
+    refresh()
+        forced fetch for an unknown key id, rate limited to one attempt per
+        min_refresh_interval
+    '''
+    def refresh(self):
+        if self.recently_attempted():
+            return self.get()
+        return self.fetch()
+
+    def fetch(self):
+        generation = self.fetches
+        with self.fetch_lock:
+            # another thread fetched while this one waited for the lock
+            if self.fetches != generation and self.jwks is not None:
+                return self.jwks
+            self.last_attempt = self.clock()
+            try:
+                response = urlopen(self.url, timeout=self.timeout)
+                jwks = json.loads(response.read())
+                max_age, stale_while_revalidate = parse_cache_control(
+                    response.headers.get("Cache-Control"))
+            except (OSError, ValueError):
+                self.errors += 1
+                if self.jwks is None:
+                    raise
+                return self.jwks
+
+            with self.lock:
+                self.jwks = jwks
+                self.fetched_at = self.clock()
+                self.max_age = self.default_ttl if max_age is None \
+                    else max_age
+                self.stale_while_revalidate = stale_while_revalidate or 0
+                self.fetches += 1
+            return jwks
+
+    def revalidate_in_background(self):
+        with self.lock:
+            if self.revalidating:
+                return
+            self.revalidating = True
+
+        def revalidate():
+            try:
+                self.fetch()
+            finally:
+                self.revalidating = False
+
+        threading.Thread(target=revalidate, daemon=True).start()
+
+    def clear(self):
+        with self.lock:
+            self.jwks = None
+            self.fetched_at = None
+            self.last_attempt = None
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "fetches": self.fetches,
+            "errors": self.errors,
+            "max_age": self.max_age,
+            "age": round(self.clock() - self.fetched_at, 3)
+            if self.fetched_at is not None else None
+        }
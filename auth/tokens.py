@@ -0,0 +1,83 @@
+"""
+Cache of verified bearer tokens.
+
+Clients reuse one access token for hours, so requires_auth keeps the claims
+of every token it verified, keyed by a SHA-256 digest of the token, until
+the token's exp. A repeat token skips the header parsing and RS256 signature
+check in verify_decode_jwt, and its permissions are kept as a frozenset so
+check_permissions is a set lookup. Tokens without exp are never cached.
+
+TOKEN_CACHE_MAX_ENTRIES bounds the cache (LRU), 0 turns it off.
+"""
+import hashlib
+import os
+import threading
+import time
+from cache.backends import MemoryBackend
+
+
+class TokenCache:
+    def __init__(self, max_entries=1024, clock=time.time):
+        self.backend = MemoryBackend(max_entries=max_entries)
+        self.enabled = max_entries > 0
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.verifications = 0
+        self.verify_total = 0.0
+        self.verify_max = 0.0
+        self.lock = threading.Lock()
+
+    '''
+    verify(token, verify_decode)
+        returns the claims of token, from the cache or by calling
+        verify_decode(token) and caching the result until its exp
+    '''
+    def verify(self, token, verify_decode):
+        key = hashlib.sha256(token.encode()).hexdigest()
+        if self.enabled:
+            claims = self.backend.get(key)
+            if claims is not None:
+                self.hits += 1
+                return claims
+            self.misses += 1
+
+        start = time.perf_counter()
+        payload = verify_decode(token)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.verifications += 1
+            self.verify_total += elapsed
+            self.verify_max = max(self.verify_max, elapsed)
+
+        claims = dict(payload)
+        if isinstance(claims.get("permissions"), list):
+            claims["permissions"] = frozenset(claims["permissions"])
+        exp = claims.get("exp")
+        if self.enabled and isinstance(exp, (int, float)):
+            ttl = exp - self.clock()
+            if ttl > 0:
+                self.backend.set(key, claims, (), ttl)
+        return claims
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "entries": len(self.backend.entries),
+            "verifications": self.verifications,
+            "verify_ms_avg": round(
+                self.verify_total * 1000 / self.verifications, 3)
+            if self.verifications else None,
+            "verify_ms_max": round(self.verify_max * 1000, 3)
+        }
+
+
+def create_token_cache():
+    return TokenCache(max_entries=int(os.environ.get(
+        "TOKEN_CACHE_MAX_ENTRIES", 1024)))
@@ -0,0 +1,85 @@
+"""
+Benchmark: JSON serialization of each model's format() / format_short().
+
+Builds 10, 100 and 1000 unsaved rows per model (each author and publisher
+with --articles related articles) and times turning them into a response
+body, i.e. format() plus the JSON provider, with the stdlib provider and
+with the orjson provider from json_provider.py. No database is used.
+
+    python benchmarks/bench_json.py --repeat 200
+"""
+import argparse
+import os
+import sys
+import time
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--repeat", type=int, default=100)
+parser.add_argument("--articles", type=int, default=5)
+args = parser.parse_args()
+
+os.environ.setdefault("DATABASE_URI", "sqlite://")
+os.environ["WARMUP"] = "off"
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from json_provider import OrjsonProvider, orjson
+from database.models import Article, Author, Publisher
+
+
+def build_rows(model, count):
+    rows = []
+    for i in range(count):
+        articles = [Article(title=f"Article {i}-{j}",
+                            article_link=f"www.bench.com/{i}/{j}",
+                            tags="bench,poem,popular",
+                            publisher_id=i, author_id=i)
+                    for j in range(args.articles)]
+        for j, article in enumerate(articles):
+            article.id = i * args.articles + j
+        if model is Article:
+            rows.append(articles[0])
+            continue
+        if model is Author:
+            row = Author(names=f"Bench {i}", lastname="Author")
+        else:
+            row = Publisher(name=f"Bench {i}", company_link="www.bench.com")
+        row.id = i
+        row.articles = articles
+        rows.append(row)
+    return rows
+
+
+def timed(provider, rows, method):
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        provider.dumps({"success": True,
+                        "items": [getattr(row, method)() for row in rows]},
+                       separators=(",", ":"))
+    return (time.perf_counter() - start) / args.repeat * 1000
+
+
+def main():
+    app = Flask(__name__)
+    providers = [("stdlib", DefaultJSONProvider(app))]
+    if orjson is not None:
+        providers.append(("orjson", OrjsonProvider(app)))
+    else:
+        print("orjson is not installed, only the stdlib provider is timed")
+
+    header = "".join(f"{name + ' ms':>12}" for name, _ in providers)
+    print(f"{'model':<10} {'method':<13} {'rows':>5}{header}")
+    for model in (Article, Author, Publisher):
+        for method in ("format", "format_short"):
+            for count in (10, 100, 1000):
+                rows = build_rows(model, count)
+                times = "".join(f"{timed(provider, rows, method):>12.3f}"
+                                for _, provider in providers)
+                print(f"{model.__name__:<10} {method:<13} {count:>5}{times}")
+
+
+if __name__ == "__main__":
+    main()
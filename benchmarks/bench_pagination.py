@@ -0,0 +1,76 @@
+"""
+Benchmark: OFFSET vs keyset pagination on GET /articles at increasing depth.
+
+Seeds a throwaway SQLite database (or the database in BENCH_DATABASE_URI)
+with --rows articles and times page requests through the Flask test client.
+Keyset latency should stay flat while OFFSET latency grows with depth.
+
+    python benchmarks/bench_pagination.py --rows 200000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rows", type=int, default=200000)
+parser.add_argument("--per-page", type=int, default=10)
+parser.add_argument("--repeat", type=int, default=20)
+args = parser.parse_args()
+
+db_file = path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URI"] = os.environ.get(
+    "BENCH_DATABASE_URI", f"sqlite:///{db_file}")
+# repeated URLs would otherwise be answered from the response cache
+os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+
+from flaskr import create_app
+from database.models import db, Article, Author, Publisher
+
+app = create_app()
+
+
+def seed():
+    with app.app_context():
+        author = Author(names="Bench", lastname="Author")
+        publisher = Publisher(name="Bench", company_link="www.bench.com")
+        author.insert()
+        publisher.insert()
+        rows = [{"title": f"Article {i}", "article_link": f"www.bench.com/{i}",
+                 "tags": "bench", "author_id": author.id,
+                 "publisher_id": publisher.id} for i in range(args.rows)]
+        db.session.execute(Article.__table__.insert(), rows)
+        db.session.commit()
+        return db.session.query(db.func.min(Article.id)).scalar()
+
+
+def timed(client, url):
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        result = client.get(url)
+        assert result.status_code == 200, (url, result.status_code)
+    return (time.perf_counter() - start) / args.repeat * 1000
+
+
+def main():
+    first_id = seed()
+    client = app.test_client()
+    pages = [p for p in (1, 10, 100, 1000, 10000, 100000)
+             if p * args.per_page <= args.rows]
+
+    print(f"{'page':>8} {'offset ms':>12} {'keyset ms':>12}")
+    for page in pages:
+        after_id = first_id + (page - 1) * args.per_page - 1
+        offset_ms = timed(
+            client, f"/articles?page={page}&per_page={args.per_page}")
+        keyset_ms = timed(
+            client, f"/articles?after_id={after_id}&per_page={args.per_page}")
+        print(f"{page:>8} {offset_ms:>12.2f} {keyset_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark: indexed full-text search vs a naive ILIKE scan over articles.
+
+Seeds a throwaway SQLite database (or the database in BENCH_DATABASE_URI)
+with articles whose titles are drawn from a small vocabulary, growing it to
+each --rows size in turn, and times GET /articles/search against the same
+query written as an ILIKE scan of the articles table. The response cache is
+disabled so every request reaches the database.
+
+    python benchmarks/bench_search.py --rows 100000 --rows 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rows", type=int, action="append")
+parser.add_argument("--per-page", type=int, default=10)
+parser.add_argument("--repeat", type=int, default=20)
+args = parser.parse_args()
+
+db_file = path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URI"] = os.environ.get(
+    "BENCH_DATABASE_URI", f"sqlite:///{db_file}")
+os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+
+from flaskr import create_app
+from database.models import db, Article, Author, Publisher
+
+WORDS = ["water", "light", "river", "stone", "winter", "garden", "silver",
+         "market", "island", "engine", "harbor", "forest", "signal", "paper",
+         "orbit", "canyon", "thunder", "velvet", "meadow", "lantern"]
+QUERIES = ["lantern", "silver river", "thunder meadow orbit"]
+
+
+app = create_app()
+
+
+def seed(start, stop):
+    random.seed(stop)
+    with app.app_context():
+        author = Author.query.first()
+        publisher = Publisher.query.first()
+        if author is None:
+            author = Author(names="Bench", lastname="Author")
+            publisher = Publisher(name="Bench", company_link="www.bench.com")
+            author.insert()
+            publisher.insert()
+        for offset in range(start, stop, 50000):
+            batch = [{"title": " ".join(random.sample(WORDS, 4)),
+                      "article_link": f"www.bench.com/{i}",
+                      "tags": random.choice(WORDS),
+                      "author_id": author.id,
+                      "publisher_id": publisher.id}
+                     for i in range(offset, min(offset + 50000, stop))]
+            db.session.execute(Article.__table__.insert(), batch)
+        db.session.commit()
+
+
+def ilike_scan(q):
+    query = Article.query.with_entities(Article.id, Article.title)
+    for term in q.split():
+        query = query.filter(Article.title.ilike(f"%{term}%")
+                             | Article.tags.ilike(f"%{term}%"))
+    total = query.count()
+    rows = query.order_by(Article.id).limit(args.per_page).all()
+    return total, rows
+
+
+def timed(fn):
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        fn()
+    return (time.perf_counter() - start) / args.repeat * 1000
+
+
+def main():
+    print(f"{'rows':>9} {'query':<22} {'search ms':>10} {'ilike ms':>10}")
+    client = app.test_client()
+    seeded = 0
+    for rows in sorted(args.rows or [100000, 1000000]):
+        seed(seeded, rows)
+        seeded = rows
+        for q in QUERIES:
+            url = f"/articles/search?q={q}&per_page={args.per_page}"
+
+            def search():
+                result = client.get(url)
+                assert result.status_code == 200, (url, result.status_code)
+
+            search_ms = timed(search)
+            with app.app_context():
+                ilike_ms = timed(lambda: ilike_scan(q))
+            print(f"{rows:>9} {q:<22} {search_ms:>10.2f} {ilike_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
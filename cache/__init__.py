@@ -0,0 +1,212 @@
+"""
+Response cache for the GET routes.
+
+Serialized JSON bodies are kept in a backend (see cache.backends) with a
+TTL. Every entry is stored under one or more tags such as "articles:5" or
+"articles:list", and the model write methods (Base.insert/update/delete)
+invalidate by tag, so a cached response is dropped as soon as any row it was
+built from changes. With RESPONSE_CACHE_URL=redis://... the entries and the
+invalidations are shared by every worker.
+
+Compressed copies of a body (see compression.py) are stored under
+"<key>|<encoding>" with the same tags, so they are invalidated together.
+
+Every entry keeps the ETag of the response next to its body, so a cache hit
+answers If-None-Match with a 304 without touching the database. @cached
+therefore wraps @conditional, which only runs on a miss.
+"""
+import os
+from functools import wraps
+from flask import current_app, g, request, make_response, Response
+from cache.backends import create_backend
+from compression import negotiate_encoding
+from database.replicas import pinned_to_primary
+
+
+# WSGI environ key of requests that must neither read nor fill the cache,
+# e.g. the synthetic warm-up requests
+SKIP_CACHE = "response_cache.skip"
+
+
+def pack_entry(etag, body):
+    return (etag or "").encode() + b"\n" + body
+
+
+def unpack_entry(value):
+    etag, _, body = value.partition(b"\n")
+    return etag.decode() or None, body
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=30, disabled_routes=()):
+        self.backend = backend
+        self.ttl = ttl
+        self.disabled_routes = set(disabled_routes)
+        self.hits = 0
+        self.misses = 0
+
+    def enabled_for(self, endpoint):
+        return endpoint not in self.disabled_routes
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, tags):
+        self.backend.set(key, value, tags, self.ttl)
+
+    '''
+    Response entries
+        (etag, body) pairs, get_entry returns None on a miss
+    '''
+    def get_entry(self, key):
+        value = self.get(key)
+        return None if value is None else unpack_entry(value)
+
+    def set_entry(self, key, etag, body, tags):
+        self.set(key, pack_entry(etag, body), tags)
+
+    def get_encoded(self, key, encoding):
+        # a missing compressed copy is not a miss, the plain body may exist
+        value = self.backend.get(f"{key}|{encoding}")
+        if value is None:
+            return None
+        self.hits += 1
+        return unpack_entry(value)
+
+    def set_encoded(self, key, encoding, etag, body, tags):
+        self.backend.set(f"{key}|{encoding}", pack_entry(etag, body), tags,
+                         self.ttl)
+
+    def invalidate(self, tags):
+        self.backend.invalidate(tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            "backend": self.backend.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl": self.ttl,
+            "disabled_routes": sorted(self.disabled_routes),
+            **self.backend.stats()
+        }
+
+
+'''
+init_cache(app)
+    attaches a ResponseCache to the app unless RESPONSE_CACHE_ENABLED=false
+'''
+def init_cache(app):
+    app.config.setdefault("RESPONSE_CACHE_ENABLED", os.environ.get(
+        "RESPONSE_CACHE_ENABLED", "true") == "true")
+    app.config.setdefault("RESPONSE_CACHE_MAX_ENTRIES", int(os.environ.get(
+        "RESPONSE_CACHE_MAX_ENTRIES", 1024)))
+    app.config.setdefault("RESPONSE_CACHE_TTL", int(os.environ.get(
+        "RESPONSE_CACHE_TTL", 30)))
+    app.config.setdefault("RESPONSE_CACHE_URL", os.environ.get(
+        "RESPONSE_CACHE_URL"))
+    app.config.setdefault("RESPONSE_CACHE_DISABLED_ROUTES", [
+        route for route in os.environ.get(
+            "RESPONSE_CACHE_DISABLED_ROUTES", "").split(",") if route])
+
+    if app.config["RESPONSE_CACHE_ENABLED"]:
+        backend = create_backend(
+            app.config["RESPONSE_CACHE_URL"],
+            max_entries=app.config["RESPONSE_CACHE_MAX_ENTRIES"])
+        app.extensions["response_cache"] = ResponseCache(
+            backend,
+            ttl=app.config["RESPONSE_CACHE_TTL"],
+            disabled_routes=app.config["RESPONSE_CACHE_DISABLED_ROUTES"])
+
+
+def get_cache():
+    return current_app.extensions.get("response_cache")
+
+
+'''
+Tags a response depends on
+    detail routes depend on their own row, list routes on the whole
+    collection plus every row requested through ?ids=. Rows embedded with
+    ?include=author,publisher tie the response to those collections too.
+'''
+def response_tags(collection, view_args):
+    tags = [f"{name.strip()}s:list"
+            for name in request.args.get("include", "").split(",")
+            if name.strip()]
+    if view_args:
+        return tags + [f"{collection}:{value}" for value in view_args.values()]
+    tags.append(f"{collection}:list")
+    for id in request.args.get("ids", "").split(","):
+        if id.strip():
+            tags.append(f"{collection}:{id.strip()}")
+    return tags
+
+
+'''
+cached_response(etag, body, weak=False)
+    a cache hit, or a 304 when the client already has this ETag. The ETag
+    of a compressed copy is the plain body's, made weak (see compression)
+'''
+def cached_response(etag, body, weak=False):
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+    if etag is not None:
+        response.set_etag(etag, weak=weak)
+    return response
+
+
+'''
+@cached(collection)
+    serves the route from the response cache, storing successful responses
+    and their ETag under the tags of the rows they were built from
+'''
+def cached(collection):
+    def cached_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            if cache is None or not cache.enabled_for(request.endpoint) \
+                    or request.environ.get(SKIP_CACHE) or pinned_to_primary():
+                # pinned clients read their own writes from the primary
+                return f(*args, **kwargs)
+
+            key = request.full_path
+            encoding = negotiate_encoding()
+            if encoding is not None:
+                entry = cache.get_encoded(key, encoding)
+                if entry is not None:
+                    response = cached_response(*entry, weak=True)
+                    if response.status_code == 200:
+                        response.headers["Content-Encoding"] = encoding
+                    return response
+
+            tags = response_tags(collection, kwargs)
+            # lets compress_response store the compressed copy
+            g.cache_entry = (key, tags)
+            entry = cache.get_entry(key)
+            if entry is not None:
+                return cached_response(*entry)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                cache.set_entry(key, response.get_etag()[0],
+                                response.get_data(), tags)
+            return response
+
+        return wrapper
+    return cached_decorator
+
+
+def invalidate(tags):
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(tags)
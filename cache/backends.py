@@ -0,0 +1,294 @@
+"""
+Storage backends for the response cache.
+
+A backend stores byte values under string keys with a TTL and indexes each
+key under a set of tags so that invalidate(tags) can drop every dependent
+entry. MemoryBackend is private to one process; RedisBackend keeps entries
+in a shared Redis (or Redis protocol compatible) server so every gunicorn
+worker sees the same entries and the same invalidations.
+"""
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+class CacheBackend:
+    name = None
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, tags, ttl):
+        raise NotImplementedError
+
+    def invalidate(self, tags):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+'''
+MemoryBackend
+    bounded LRU with a per entry expiry, least recently used entries are
+    evicted once max_entries is reached
+'''
+class MemoryBackend(CacheBackend):
+    name = "memory"
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, tags, ttl):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + ttl, value, tags)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        with self.lock:
+            for tag in tags:
+                for key in self.tags.pop(tag, ()):
+                    self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def stats(self):
+        return {
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries
+        }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+
+class RedisError(Exception):
+    pass
+
+
+'''
+RedisConnection
+    minimal RESP2 client, enough for the handful of commands the cache
+    uses. Commands passed together are pipelined in a single round trip.
+'''
+class RedisConnection:
+    def __init__(self, host="localhost", port=6379, db=0, password=None,
+                 timeout=0.5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port),
+                                             self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._send(setup)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.reader.close()
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reader = None
+
+    def execute(self, *commands):
+        with self.lock:
+            # retry once on a fresh connection, e.g. after a server restart
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self.connect()
+                    return self._send(commands)
+                except (OSError, EOFError):
+                    self.close()
+                    if attempt:
+                        raise
+
+    def _send(self, commands):
+        payload = bytearray()
+        for command in commands:
+            payload += b"*%d\r\n" % len(command)
+            for arg in command:
+                if not isinstance(arg, bytes):
+                    arg = str(arg).encode()
+                payload += b"$%d\r\n%s\r\n" % (len(arg), arg)
+        self.sock.sendall(payload)
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+            # commands that failed inside MULTI/EXEC come back in its reply
+            if isinstance(reply, list):
+                for item in reply:
+                    if isinstance(item, RedisError):
+                        raise item
+        return replies
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise EOFError("connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+
+'''
+RedisBackend
+    entries live at <prefix><key> with EX ttl, each tag is a set of the keys
+    stored under it. Invalidating a tag deletes its keys on the server, so
+    the invalidation reaches every worker at once. Eviction under memory
+    pressure is left to the server's maxmemory policy.
+
+    set() writes an entry and its tag memberships in one MULTI/EXEC, and
+    invalidate() reads and deletes the tag sets in one MULTI/EXEC before
+    deleting the entries. An entry stored concurrently is therefore either
+    in a tag set that was read (and is deleted) or in a fresh tag set that a
+    later invalidation will find; it never loses its tags while it lives.
+
+    Errors talking to the server are counted and treated as a miss, the
+    routes then fall back to the database.
+'''
+class RedisBackend(CacheBackend):
+    name = "redis"
+
+    def __init__(self, url, prefix="rc:", timeout=0.5):
+        parsed = urlparse(url)
+        self.prefix = prefix
+        self.errors = 0
+        self.connection = RedisConnection(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(parsed.path.lstrip("/") or 0),
+            password=parsed.password,
+            timeout=timeout)
+
+    def get(self, key):
+        try:
+            return self.connection.execute(("GET", self.prefix + key))[0]
+        except (OSError, EOFError, RedisError):
+            self.errors += 1
+            return None
+
+    def set(self, key, value, tags, ttl):
+        commands = [("MULTI",),
+                    ("SET", self.prefix + key, value, "EX", max(int(ttl), 1))]
+        for tag in tags:
+            tag_key = self.prefix + "tag:" + tag
+            commands.append(("SADD", tag_key, key))
+            commands.append(("EXPIRE", tag_key, max(int(ttl), 1) + 60))
+        commands.append(("EXEC",))
+        try:
+            self.connection.execute(*commands)
+        except (OSError, EOFError, RedisError):
+            self.errors += 1
+
+    def invalidate(self, tags):
+        if not tags:
+            return
+        tag_keys = [self.prefix + "tag:" + tag for tag in tags]
+        try:
+            replies = self.connection.execute(
+                ("MULTI",), *[("SMEMBERS", tag_key) for tag_key in tag_keys],
+                ("DEL", *tag_keys), ("EXEC",))
+            members = replies[-1][:len(tag_keys)]
+            keys = {self.prefix + key.decode()
+                    for tag_members in members for key in tag_members}
+            if keys:
+                self.connection.execute(("DEL", *keys))
+        except (OSError, EOFError, RedisError):
+            self.errors += 1
+
+    def clear(self):
+        # drops every key under this backend's prefix, SCAN walks the
+        # keyspace in small steps instead of blocking the server like KEYS
+        try:
+            cursor = b"0"
+            while True:
+                cursor, keys = self.connection.execute(
+                    ("SCAN", cursor, "MATCH", self.prefix + "*",
+                     "COUNT", 500))[0]
+                if keys:
+                    self.connection.execute(("DEL", *keys))
+                if cursor == b"0":
+                    break
+        except (OSError, EOFError, RedisError):
+            self.errors += 1
+
+    def stats(self):
+        return {"errors": self.errors}
+
+
+def create_backend(url=None, max_entries=1024):
+    if url and url.startswith("redis://"):
+        return RedisBackend(url)
+    return MemoryBackend(max_entries=max_entries)
@@ -0,0 +1,115 @@
+"""
+Response compression.
+
+JSON and text responses of at least COMPRESSION_MIN_SIZE bytes are
+compressed with the best encoding the client accepts: br when the brotli
+package is installed, otherwise gzip. COMPRESSION_LEVEL sets the gzip level
+(1-9) and COMPRESSION_BROTLI_QUALITY the brotli quality (0-11).
+
+The response cache (see cache.cached) keeps the compressed bytes of a cached
+response next to the plain ones, so a hot response is compressed once per
+encoding rather than on every hit. ETags of compressed responses are made
+weak, as they stand for the same data in another encoding and a client's
+If-None-Match should still match whichever form it saw.
+"""
+import gzip
+import os
+from flask import current_app, g, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "text/")
+
+
+def available_encodings():
+    if brotli is not None:
+        return ["br", "gzip"]
+    return ["gzip"]
+
+
+'''
+negotiate_encoding()
+    the encoding to compress the current response with, or None when
+    compression is off or the client accepts none of the available ones
+'''
+def negotiate_encoding():
+    if not current_app.config.get("COMPRESSION_ENABLED"):
+        return None
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(
+            data, quality=current_app.config["COMPRESSION_BROTLI_QUALITY"])
+    return gzip.compress(data, current_app.config["COMPRESSION_LEVEL"],
+                         mtime=0)
+
+
+def mark_encoded(response, encoding):
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def compressible(response):
+    return response.status_code == 200 and not response.direct_passthrough \
+        and response.mimetype.startswith(COMPRESSIBLE_MIMETYPES)
+
+
+'''
+compress_response(response)
+    after_request hook, compresses responses over the size threshold and
+    stores the result in the response cache when the view was cacheable.
+    Compressible responses and every 304 get Vary: Accept-Encoding.
+'''
+def compress_response(response):
+    if response.status_code == 304:
+        # caches must pair a 304 with the encoding of the 200 it stands for
+        response.vary.add("Accept-Encoding")
+        return response
+    if not compressible(response):
+        return response
+    response.vary.add("Accept-Encoding")
+    if "Content-Encoding" in response.headers:
+        # served compressed by the response cache
+        mark_encoded(response, response.headers["Content-Encoding"])
+        return response
+
+    encoding = negotiate_encoding()
+    data = response.get_data()
+    if encoding is None or \
+            len(data) < current_app.config["COMPRESSION_MIN_SIZE"]:
+        return response
+
+    compressed = compress(data, encoding)
+    response.set_data(compressed)
+    mark_encoded(response, encoding)
+
+    cache_entry = g.get("cache_entry")
+    cache = current_app.extensions.get("response_cache")
+    if cache_entry is not None and cache is not None:
+        key, tags = cache_entry
+        cache.set_encoded(key, encoding, response.get_etag()[0], compressed,
+                          tags)
+    return response
+
+
+'''
+init_compression(app)
+    reads the COMPRESSION_* settings and installs the after_request hook
+'''
+def init_compression(app):
+    app.config.setdefault("COMPRESSION_ENABLED", os.environ.get(
+        "COMPRESSION_ENABLED", "true") == "true")
+    app.config.setdefault("COMPRESSION_MIN_SIZE", int(os.environ.get(
+        "COMPRESSION_MIN_SIZE", 500)))
+    app.config.setdefault("COMPRESSION_LEVEL", int(os.environ.get(
+        "COMPRESSION_LEVEL", 6)))
+    app.config.setdefault("COMPRESSION_BROTLI_QUALITY", int(os.environ.get(
+        "COMPRESSION_BROTLI_QUALITY", 4)))
+    app.after_request(compress_response)
@@ -0,0 +1,61 @@
+"""
+Conditional GET support for the read routes.
+
+Detail responses get a strong ETag built from the row version columns
+(see Base.version_query), so a matching If-None-Match is answered with a
+304 after one indexed query and without building the body. List responses
+get an ETag hashed from the response body.
+
+Routes apply @cached outside @conditional: cached responses carry their
+ETag and are answered from the cache, this only runs on a cache miss.
+"""
+import hashlib
+from functools import wraps
+from flask import request, make_response, Response
+
+
+def detail_etag(model, id):
+    rows = model.version_query(id).all()
+    if not rows:
+        return None
+    # the query string selects the representation, e.g. ?fields=
+    versions = repr(([tuple(row) for row in rows], request.query_string))
+    digest = hashlib.sha1(versions.encode()).hexdigest()[:20]
+    return f'{model.__tablename__}-{id}-{digest}'
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+'''
+@conditional(model)
+    adds an ETag to successful responses of the route and answers a
+    matching If-None-Match with 304 Not Modified
+'''
+def conditional(model):
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not kwargs:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200:
+                    response.add_etag()
+                    response.make_conditional(request)
+                return response
+
+            etag = detail_etag(model, *kwargs.values())
+            if etag is None:
+                return f(*args, **kwargs)
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+
+        return wrapper
+    return conditional_decorator
@@ -0,0 +1,324 @@
+"""
+Bulk writes used by the /<collection>/bulk routes.
+
+Rows are validated up front, then written with batched multi-row
+statements inside a single transaction instead of one Base.insert()
+(session.add + commit) per row.
+"""
+import time
+from sqlalchemy import Integer, bindparam, column, or_, values as values_
+from sqlalchemy.dialects import postgresql, sqlite
+from database.models import db, Article
+from database.tags import set_article_tags
+from cache import invalidate as invalidate_cache
+
+MAX_BULK_ITEMS = 5000
+BATCH_SIZE = 500
+
+
+'''
+Check foreign keys for a batch of rows
+    one IN query per foreign key column, returns an error message for each
+    row index that points at a missing parent row
+'''
+def missing_parents(model, rows):
+    errors = {}
+    for foreign_key in model.__table__.foreign_keys:
+        key = foreign_key.parent.name
+        wanted = {values[key] for values in rows.values()
+                  if values.get(key) is not None}
+        if not wanted:
+            continue
+        target = foreign_key.column
+        existing = {id for (id,) in db.session.query(target)
+                    .filter(target.in_(wanted))}
+        for index, values in rows.items():
+            if values.get(key) is not None and values[key] not in existing:
+                errors.setdefault(index, f'{key} {values[key]} does not exist')
+    return errors
+
+
+'''
+Check the natural key of a batch of new rows
+    one IN query, returns an error message for each row index whose key
+    already exists or repeats an earlier row of the batch
+'''
+def taken_keys(model, rows):
+    natural_key = getattr(model, "natural_key", None)
+    if natural_key is None or not rows:
+        return {}
+    key = model.__table__.c[natural_key]
+    taken = {value for (value,) in db.session.query(key).filter(
+        key.in_({values[natural_key] for values in rows.values()}))}
+    errors = {}
+    for index, values in rows.items():
+        if values[natural_key] in taken:
+            errors[index] = \
+                f'{natural_key} {values[natural_key]} already exists'
+        taken.add(values[natural_key])
+    return errors
+
+
+'''
+Insert rows and return their new ids, in order
+    postgres gets multi-row INSERT ... VALUES ... RETURNING id statements of
+    BATCH_SIZE rows. Dialects without RETURNING fall back to
+    bulk_insert_mappings, which still shares one transaction.
+'''
+def insert_rows(model, rows):
+    table = model.__table__
+    if db.engine.dialect.name == "postgresql":
+        ids = []
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            result = db.session.execute(
+                table.insert().values(batch).returning(table.c.id))
+            ids += [id for (id,) in result]
+        return ids
+
+    mappings = [dict(values) for values in rows]
+    db.session.bulk_insert_mappings(model, mappings, return_defaults=True)
+    return [values["id"] for values in mappings]
+
+
+'''
+Insert complete rows keyed by the model's natural_key, return their ids
+    INSERT ... ON CONFLICT (natural_key) DO UPDATE in batches of BATCH_SIZE
+    rows, so a row another transaction inserted since it was looked up is
+    overwritten (and its version bumped) instead of duplicated. The ids are
+    read back with one IN query on the unique key. Dialects without ON
+    CONFLICT fall back to insert_rows.
+'''
+def upsert_rows(model, rows):
+    table = model.__table__
+    key = table.c[model.natural_key]
+    insert = {"postgresql": postgresql.insert,
+              "sqlite": sqlite.insert}.get(db.engine.dialect.name)
+    if insert is None:
+        return insert_rows(model, rows)
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        statement = insert(table).values(batch)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={table.c.version: table.c.version + 1,
+                  **{name: statement.excluded[name] for name in batch[0]}}))
+    ids = dict(db.session.query(key, table.c.id)
+               .filter(key.in_([values[key.name] for values in rows])))
+    return [ids[values[key.name]] for values in rows]
+
+
+'''
+Update rows with the same set of changed columns
+    each entry of params holds the row id and the new values. postgres runs
+    one UPDATE ... FROM (VALUES ...) per BATCH_SIZE rows, other dialects an
+    executemany UPDATE. Core updates bypass the mapper, so the row version
+    is bumped here.
+'''
+def update_rows(model, columns, params):
+    table = model.__table__
+    if db.engine.dialect.name == "postgresql":
+        for start in range(0, len(params), BATCH_SIZE):
+            batch = params[start:start + BATCH_SIZE]
+            changes = values_(
+                column("id", Integer),
+                *[column(name, table.c[name].type) for name in columns],
+                name="changes"
+            ).data([(row["id"], *[row[name] for name in columns])
+                    for row in batch])
+            db.session.execute(
+                table.update()
+                .where(table.c.id == changes.c.id)
+                .values({table.c.version: table.c.version + 1,
+                         **{name: changes.c[name] for name in columns}}))
+        return
+
+    statement = table.update()\
+        .where(table.c.id == bindparam("b_id"))\
+        .values({table.c.version: table.c.version + 1,
+                 **{name: bindparam("b_" + name) for name in columns}})
+    db.session.execute(statement, [
+        {"b_" + name: value for name, value in row.items()}
+        for row in params])
+
+
+def bulk_tags(model, rows):
+    tags = [f'{model.__tablename__}:list']
+    if model is Article:
+        tags.append('tags:list')
+    for values in rows:
+        if "id" in values:
+            tags.append(f'{model.__tablename__}:{values["id"]}')
+        if model is Article:
+            for key, collection in [("author_id", "authors"),
+                                    ("publisher_id", "publishers")]:
+                if values.get(key) is not None:
+                    tags.append(f'{collection}:{values[key]}')
+    return tags
+
+
+'''
+bulk_create(model, items)
+    validates every item, inserts the valid ones in one transaction and
+    reports per item ids or errors plus the insert throughput
+'''
+def bulk_create(model, items):
+    start = time.perf_counter()
+    rows = {}
+    errors = {}
+    for index, item in enumerate(items):
+        try:
+            rows[index] = model.validate(item)
+        except ValueError as e:
+            errors[index] = str(e)
+
+    errors.update(missing_parents(model, rows))
+    errors.update(taken_keys(model, {index: values
+                                     for index, values in rows.items()
+                                     if index not in errors}))
+    valid = [(index, values) for index, values in rows.items()
+             if index not in errors]
+
+    ids = []
+    if valid:
+        try:
+            ids = insert_rows(model, [values for _, values in valid])
+            if model is Article:
+                set_article_tags(db.session.connection(), {
+                    id: values["tags"] for (_, values), id in zip(valid, ids)})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        invalidate_cache(bulk_tags(model, [values for _, values in valid]))
+
+    elapsed = time.perf_counter() - start
+    return {
+        "created": [{"index": index, "id": id}
+                    for (index, _), id in zip(valid, ids)],
+        "errors": [{"index": index, "message": message}
+                   for index, message in sorted(errors.items())],
+        "total_created": len(ids),
+        "rows_per_second": round(len(ids) / elapsed) if elapsed else None
+    }
+
+
+'''
+bulk_upsert(model, items)
+    applies partial rows keyed by "id" or by the model's natural_key in one
+    transaction: one SELECT for every matching row, batched INSERT ... ON
+    CONFLICT statements for new rows (see upsert_rows) and batched UPDATEs
+    that write only the columns that changed. Items keyed by natural_key
+    that match nothing are created and must then be complete. Reports
+    created, updated and unchanged counts.
+'''
+def bulk_upsert(model, items):
+    start = time.perf_counter()
+    table = model.__table__
+    natural_key = model.natural_key
+    rows = {}
+    errors = {}
+    for index, item in enumerate(items):
+        try:
+            values = model.validate(item, partial=True)
+            if "id" in item:
+                if type(item["id"]) is not int:
+                    raise ValueError('id must be an integer')
+            elif natural_key not in values:
+                raise ValueError(f'id or {natural_key} is required')
+            rows[index] = values
+        except ValueError as e:
+            errors[index] = str(e)
+
+    errors.update(missing_parents(model, rows))
+    rows = {index: values for index, values in rows.items()
+            if index not in errors}
+
+    ids = {items[index]["id"] for index in rows if "id" in items[index]}
+    keys = {values[natural_key] for index, values in rows.items()
+            if "id" not in items[index]}
+    existing = db.session.query(*table.c)\
+        .filter(or_(table.c.id.in_(ids), table.c[natural_key].in_(keys)))\
+        .all()
+    by_id = {row.id: row for row in existing}
+    by_key = {}
+    for row in existing:
+        by_key.setdefault(getattr(row, natural_key), []).append(row)
+
+    results = {}
+    inserts = []
+    updates = {}
+    tag_rows = []
+    seen = set()
+    for index, values in rows.items():
+        item = items[index]
+        if "id" in item:
+            row = by_id.get(item["id"])
+            if row is None:
+                errors[index] = f'id {item["id"]} does not exist'
+                continue
+        else:
+            # only without the unique index, i.e. before its migration ran
+            matches = by_key.get(values[natural_key], [])
+            if len(matches) > 1:
+                errors[index] = f'{natural_key} {values[natural_key]} ' \
+                    'matches more than one row'
+                continue
+            row = matches[0] if matches else None
+
+        target = row.id if row else values[natural_key]
+        if target in seen:
+            errors[index] = 'duplicate item'
+            continue
+        seen.add(target)
+
+        if row is None:
+            try:
+                inserts.append((index, model.validate(item)))
+            except ValueError as e:
+                errors[index] = str(e)
+            continue
+
+        changed = {key: value for key, value in values.items()
+                   if getattr(row, key) != value}
+        results[index] = {"index": index, "id": row.id, "status": "unchanged"}
+        if changed:
+            results[index]["status"] = "updated"
+            updates.setdefault(tuple(sorted(changed)), []).append(
+                dict(changed, id=row.id))
+            tag_rows += [row._asdict(), changed]
+
+    try:
+        tags_by_article = {}
+        for columns, params in updates.items():
+            update_rows(model, columns, params)
+            if "tags" in columns:
+                tags_by_article.update(
+                    {row["id"]: row["tags"] for row in params})
+        if inserts:
+            new_ids = upsert_rows(model, [values for _, values in inserts])
+            for (index, values), id in zip(inserts, new_ids):
+                results[index] = {"index": index, "id": id,
+                                  "status": "created"}
+                tag_rows.append(values)
+                tags_by_article[id] = values["tags"]
+        if model is Article:
+            set_article_tags(db.session.connection(), tags_by_article)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if tag_rows:
+        invalidate_cache(bulk_tags(model, tag_rows))
+
+    counts = {"created": 0, "updated": 0, "unchanged": 0}
+    for result in results.values():
+        counts[result["status"]] += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "results": [results[index] for index in sorted(results)],
+        "errors": [{"index": index, "message": message}
+                   for index, message in sorted(errors.items())],
+        **counts,
+        "rows_per_second": round(len(rows) / elapsed) if elapsed else None
+    }
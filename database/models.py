@@ -1,8 +1,15 @@
 import os
 from sqlalchemy import Column, String, Integer, Text, ForeignKey, create_engine
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.ext.declarative import declared_attr
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 import json
 from flask_migrate import Migrate
+from cache import invalidate as invalidate_cache
+from database.pool import engine_options
+from database.replicas import RoutingSession, replica_binds, replica_uris
 
 database_name = os.environ.get('TABLE_NAME')
 user = os.environ.get('DB_USER')
@@ -12,22 +19,42 @@ database_path = "postgresql://{}:{}@{}/{}".format(
 )
 
 database_uri = os.environ.get('DATABASE_URI')
-db = SQLAlchemy()
+# reads during GET requests go to DATABASE_REPLICA_URIS, see database/replicas.py
+# expire_on_commit=False: after Base.insert/update commit, the write routes
+# format the row from memory instead of reloading it with another SELECT
+db = SQLAlchemy(session_options={"class_": RoutingSession,
+                                 "expire_on_commit": False})
 
 if database_uri:
     database_path = database_uri
+
+# databases create_all already ran against in this process
+created_schemas = set()
+
 """
 setup_db(app)
     binds a flask application and a SQLAlchemy service
 """
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_uris=replica_uris):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    db.app = app
+    # pool sizing, pre-ping, recycle etc. from env, see database/pool.py
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    app.config["SQLALCHEMY_BINDS"] = replica_binds(replica_uris)
+    # selectin or joined, used when detail routes load related articles
+    app.config.setdefault("RELATIONSHIP_LOAD_STRATEGY", os.environ.get(
+        "RELATIONSHIP_LOAD_STRATEGY", "selectin"))
+    # set DB_CREATE_ALL=false where migrations manage the schema, and for
+    # every `flask db` command (the README deployment step)
+    app.config.setdefault("DB_CREATE_ALL", os.environ.get(
+        "DB_CREATE_ALL", "true") == "true")
     db.init_app(app)
-    with app.app_context():
-        db.create_all()
-        # Migrate(app, db)
+    if app.config["DB_CREATE_ALL"] and database_path not in created_schemas:
+        with app.app_context():
+            # primary only, replicas get the schema through replication
+            db.create_all(bind_key=None)
+        created_schemas.add(database_path)
+    Migrate(app, db)
         
         
 """
@@ -36,22 +63,176 @@ Db Models - start with base
 class Base(db.Model):
     __abstract__ = True
     id = Column(Integer, primary_key=True)
+    # bumped by SQLAlchemy on every UPDATE, used for ETags
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+
+    @declared_attr
+    def __mapper_args__(cls):
+        return {"version_id_col": cls.version}
     
     # Base methods to use throughout
+    # each write drops the cached responses built from the affected rows
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        invalidate_cache(self.cache_tags())
 
     def update(self):
+        tags = self.cache_tags()
         db.session.commit()
+        invalidate_cache(tags)
 
     def delete(self):
         db.session.delete(self)
+        # flushing first loads anything removed by cascade
+        db.session.flush()
+        tags = self.cache_tags()
         db.session.commit()
+        invalidate_cache(tags)
         
     def rollback(self):
         db.session.rollback()
 
+    '''
+    Response cache tags
+        the cached responses that depend on this row, see cache.cached
+    '''
+    def cache_tags(self):
+        return [f'{self.__tablename__}:{self.id}',
+                f'{self.__tablename__}:list']
+
+    '''
+    Validate a request body
+        returns the column values for a new row or raises ValueError with a
+        message for the client. required_fields are non empty strings that
+        must fit their column. With partial=True only the fields present in
+        the body are checked and returned.
+    '''
+    required_fields = ()
+
+    @classmethod
+    def validate(cls, body, partial=False):
+        if not isinstance(body, dict):
+            raise ValueError('expected an object')
+        values = {}
+        for key in cls.required_fields:
+            if partial and key not in body:
+                continue
+            value = body.get(key)
+            if not isinstance(value, str) or not value.strip():
+                raise ValueError(f'{key} is required')
+            length = cls.__table__.c[key].type.length
+            if length and len(value) > length:
+                raise ValueError(f'{key} is longer than {length} characters')
+            values[key] = value
+        return values
+
+    '''
+    Projected queries for list routes
+        select only the columns format_short_row() needs and return plain
+        rows, skipping ORM instantiation and identity map bookkeeping
+    '''
+    @classmethod
+    def short_query(cls):
+        return db.session.query(*cls.short_columns())
+
+    '''
+    Query used by the detail routes
+        models with related articles override this to eager load them
+    '''
+    @classmethod
+    def detail_query(cls):
+        return cls.query
+
+    '''
+    Rows that make up the ETag of a detail response
+        only version numbers are selected, by primary key, so a conditional
+        GET can be answered without loading the entity
+    '''
+    @classmethod
+    def version_query(cls, id):
+        return db.session.query(cls.version).filter(cls.id == id)
+
+    '''
+    Fetch many rows by id with a single IN query
+        returns a dict of id -> instance, missing ids are simply absent
+    '''
+    @classmethod
+    def get_many(cls, ids):
+        return {instance.id: instance for instance in
+                cls.detail_query().filter(cls.id.in_(ids)).all()}
+
+    '''
+    Sparse fieldsets, see fieldsets.py
+        field_columns is the allow-list of ?fields=, mapping every key of
+        format() to the columns it is built from. fieldset_query selects
+        the id, those columns and any extra (sort) columns, once each.
+    '''
+    field_columns = {}
+
+    @classmethod
+    def fieldset_query(cls, fields, extra_columns=()):
+        columns = [cls.id] + [column for field in fields
+                              for column in cls.field_columns[field]]
+        columns = {column.key: column
+                   for column in columns + list(extra_columns)}
+        return db.session.query(*columns.values())
+
+    @staticmethod
+    def format_field(row, field):
+        return getattr(row, field)
+
+
+'''
+Eager load the articles relationship
+    loads only the id and title of each article, which is all format()
+    needs, using the configured strategy so the number of queries does not
+    grow with the number of articles
+'''
+def load_articles(relationship):
+    strategy = current_app.config.get("RELATIONSHIP_LOAD_STRATEGY")
+    loader = joinedload if strategy == "joined" else selectinload
+    return loader(relationship).load_only(Article.id, Article.title)
+
+"""
+Tags
+
+Article.tags keeps the comma joined string returned by the API. Each tag is
+also stored once in tags and linked through article_tags, which is indexed
+for tag lookups. database.tags keeps both in sync on every article write.
+"""
+article_tags = db.Table(
+    'article_tags',
+    Column('article_id', Integer, ForeignKey('articles.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('tag_id', Integer, ForeignKey('tags.id', ondelete='CASCADE'),
+           primary_key=True),
+    db.Index('ix_article_tags_tag_id_article_id', 'tag_id', 'article_id')
+)
+
+
+class Tag(db.Model):
+    __tablename__ = 'tags'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(250), nullable=False, unique=True)
+    # maintained incrementally by database.tags on every article write
+    article_count = Column(Integer, nullable=False, default=0,
+                           server_default='0', index=True)
+
+    @classmethod
+    def short_query(cls):
+        return db.session.query(cls.id, cls.name, cls.article_count)\
+            .filter(cls.article_count > 0)
+
+    @staticmethod
+    def format_short_row(row):
+        return {
+            'name': row.name,
+            'count': row.article_count
+            }
+
+
 """
 Article
 
@@ -65,8 +246,23 @@ class Article(Base):
     tags = Column(String(250), nullable=False)
     publisher_id = Column(Integer, ForeignKey("publishers.id"))
     author_id = Column(Integer, ForeignKey("authors.id"))
-
-    
+    # filter / sort columns lead, id follows as the keyset tie breaker
+    __table_args__ = (
+        db.Index('ix_articles_author_id_id', 'author_id', 'id'),
+        db.Index('ix_articles_publisher_id_id', 'publisher_id', 'id'),
+        db.Index('ix_articles_title_id', 'title', 'id'),
+        # the ON CONFLICT target of database.bulk.upsert_rows
+        db.Index('ux_articles_article_link', 'article_link', unique=True),
+    )
+        
+    required_fields = ('title', 'article_link')
+    field_columns = {
+        'id': (), 'title': (title,), 'publisher_id': (publisher_id,),
+        'author_id': (author_id,), 'tags': (tags,),
+        'article_link': (article_link,)
+    }
+    # alternative key for upserts, see database.bulk.bulk_upsert
+    natural_key = 'article_link'
         
     def __init__(self, title,
                  publisher_id, author_id, tags, article_link):
@@ -77,6 +273,46 @@ class Article(Base):
         self.article_link = article_link
         
 
+    @classmethod
+    def validate(cls, body, partial=False):
+        values = super().validate(body, partial)
+        if not partial or 'tags' in body:
+            tags = body.get('tags')
+            if not isinstance(tags, list) or \
+                    not all(isinstance(tag, str) for tag in tags):
+                raise ValueError('tags must be a list of strings')
+            values['tags'] = ",".join(tags)
+            if len(values['tags']) > cls.tags.type.length:
+                raise ValueError('tags are too long')
+        for key in ('publisher_id', 'author_id'):
+            if partial and key not in body:
+                continue
+            if type(body.get(key)) is not int:
+                raise ValueError(f'{key} must be an integer')
+            values[key] = body.get(key)
+        return values
+
+    @classmethod
+    def version_query(cls, id):
+        # ?include= embeds the author and publisher, their versions count too
+        return db.session.query(cls.version, Author.version,
+                                Publisher.version)\
+            .outerjoin(Author, cls.author_id == Author.id)\
+            .outerjoin(Publisher, cls.publisher_id == Publisher.id)\
+            .filter(cls.id == id)
+
+    def cache_tags(self):
+        # parents embed the article title, including the old parent when
+        # the article is moved to another author or publisher
+        state = inspect(self)
+        tags = super().cache_tags() + ['tags:list']
+        for key, collection in [("author_id", "authors"),
+                                ("publisher_id", "publishers")]:
+            for value in state.attrs[key].history.sum():
+                if value is not None:
+                    tags.append(f'{collection}:{value}')
+        return tags
+
     def format(self):
         return {
             'id': self.id,
@@ -88,10 +324,18 @@ class Article(Base):
             }
         
     def format_short(self):
+        return self.format_short_row(self)
+
+    @classmethod
+    def short_columns(cls):
+        return [cls.id, cls.title, cls.tags]
+
+    @staticmethod
+    def format_short_row(row):
         return {
-            'id': self.id,
-            'title': self.title,
-            'tags': self.tags
+            'id': row.id,
+            'title': row.title,
+            'tags': row.tags
             }
         
     
@@ -106,14 +350,45 @@ class Author(Base):
     id = Column(Integer, primary_key=True)
     names = Column(String(80), nullable=False)
     lastname = Column(String(50), nullable=False)
+    __table_args__ = (
+        db.Index('ix_authors_lastname_id', 'lastname', 'id'),
+    )
     articles = db.relationship('Article', backref='authors',
                                cascade='all, delete-orphan')
+    required_fields = ('names', 'lastname')
+    field_columns = {'id': (), 'full_name': (names, lastname), 'articles': ()}
+    # the Article column pointing back here, for the articles field
+    article_parent_key = 'author_id'
 
     def __init__(self, names, lastname):
         self.names = names
         self.lastname = lastname
         self.articles = []
-    
+
+    @classmethod
+    def detail_query(cls):
+        return cls.query.options(load_articles(cls.articles))
+
+    @classmethod
+    def version_query(cls, id):
+        # the response embeds article titles, so their versions count too
+        return db.session.query(cls.version, Article.id, Article.version)\
+            .outerjoin(cls.articles).filter(cls.id == id)\
+            .order_by(Article.id)
+
+    def cache_tags(self):
+        # article responses only embed this row through ?include=, which
+        # depends on the authors list tag. Articles and tag counts change
+        # only when articles go with the row (delete) or are reassigned.
+        tags = super().cache_tags()
+        state = inspect(self)
+        if 'articles' not in state.unloaded and \
+                (state.deleted or state.attrs.articles.history.has_changes()):
+            tags += ['articles:list', 'tags:list']
+            tags += [f'articles:{article.id}' for article in self.articles]
+            tags += [f'articles:{article.id}' for article in
+                     state.attrs.articles.history.deleted]
+        return tags
 
     def format(self):
         return {
@@ -124,9 +399,23 @@ class Author(Base):
             }
         
     def format_short(self):
+        return self.format_short_row(self)
+
+    @staticmethod
+    def format_field(row, field):
+        if field == 'full_name':
+            return f'{row.names}  {row.lastname}'
+        return getattr(row, field)
+
+    @classmethod
+    def short_columns(cls):
+        return [cls.id, cls.names, cls.lastname]
+
+    @staticmethod
+    def format_short_row(row):
         return {
-            'id': self.id,
-            'full_name': f'{self.names}  {self.lastname}',
+            'id': row.id,
+            'full_name': f'{row.names}  {row.lastname}',
             }
         
 """
@@ -139,14 +428,43 @@ class Publisher(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(120), nullable=False)
     company_link = Column(String(120), nullable=False)
+    __table_args__ = (
+        db.Index('ix_publishers_name_id', 'name', 'id'),
+    )
     articles = db.relationship('Article', backref='publishers',
                                cascade='all, delete-orphan')
+    required_fields = ('name', 'company_link')
+    field_columns = {'id': (), 'name': (name,),
+                     'company_link': (company_link,), 'articles': ()}
+    article_parent_key = 'publisher_id'
 
     def __init__(self, name, company_link):
         self.name = name
         self.company_link = company_link
         self.articles = []
-    
+
+    @classmethod
+    def detail_query(cls):
+        return cls.query.options(load_articles(cls.articles))
+
+    @classmethod
+    def version_query(cls, id):
+        # the response embeds article titles, so their versions count too
+        return db.session.query(cls.version, Article.id, Article.version)\
+            .outerjoin(cls.articles).filter(cls.id == id)\
+            .order_by(Article.id)
+
+    def cache_tags(self):
+        # see Author.cache_tags
+        tags = super().cache_tags()
+        state = inspect(self)
+        if 'articles' not in state.unloaded and \
+                (state.deleted or state.attrs.articles.history.has_changes()):
+            tags += ['articles:list', 'tags:list']
+            tags += [f'articles:{article.id}' for article in self.articles]
+            tags += [f'articles:{article.id}' for article in
+                     state.attrs.articles.history.deleted]
+        return tags
 
     def format(self):
         return {
@@ -158,8 +476,16 @@ class Publisher(Base):
             }
         
     def format_short(self):
+        return self.format_short_row(self)
+
+    @classmethod
+    def short_columns(cls):
+        return [cls.id, cls.name]
+
+    @staticmethod
+    def format_short_row(row):
         return {
-            'id': self.id,
-            'name': self.name
+            'id': row.id,
+            'name': row.name
             }
 
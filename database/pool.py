@@ -0,0 +1,111 @@
+"""
+Connection pool settings for setup_db.
+
+SQLALCHEMY_ENGINE_OPTIONS is built from the environment:
+
+    DB_POOL_SIZE              connections kept open per worker (5)
+    DB_MAX_OVERFLOW           extra connections allowed under load (10)
+    DB_POOL_TIMEOUT           seconds to wait for a free connection (30)
+    DB_POOL_RECYCLE           seconds before a connection is replaced (1800)
+    DB_POOL_PRE_PING          test connections on checkout (true)
+    DB_STATEMENT_TIMEOUT_MS   server side statement timeout, 0 is none (0)
+    DB_APPLICATION_NAME       name shown in pg_stat_activity (capstone)
+
+Pre-ping and recycle drop connections left stale by a failover before a
+request uses them. SQLite keeps SQLAlchemy's default pool, only the other
+databases get the sized TimedQueuePool.
+"""
+import os
+import threading
+import time
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+
+'''
+TimedQueuePool
+    QueuePool that records how long checkouts wait for a free connection
+'''
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self.stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def wait_stats(self):
+        with self.stats_lock:
+            return {
+                "checkouts": self.checkouts,
+                "wait_ms_total": round(self.wait_total * 1000, 3),
+                "wait_ms_max": round(self.wait_max * 1000, 3),
+                "wait_ms_avg": round(
+                    self.wait_total * 1000 / self.checkouts, 3)
+                if self.checkouts else 0.0
+            }
+
+
+def env_bool(name, default):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+
+'''
+engine_options(database_path)
+    returns the SQLALCHEMY_ENGINE_OPTIONS for the configured database
+'''
+def engine_options(database_path):
+    options = {
+        "pool_pre_ping": env_bool("DB_POOL_PRE_PING", "true"),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    }
+    backend = make_url(database_path).get_backend_name()
+    if backend == "sqlite":
+        return options
+
+    options.update({
+        "poolclass": TimedQueuePool,
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+    })
+    if backend == "postgresql":
+        connect_args = {"application_name": os.environ.get(
+            "DB_APPLICATION_NAME", "capstone")}
+        statement_timeout = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 0))
+        if statement_timeout:
+            connect_args["options"] = \
+                f"-c statement_timeout={statement_timeout}"
+        options["connect_args"] = connect_args
+    return options
+
+
+'''
+pool_stats(engine)
+    current size and in use counts of the engine's pool, plus checkout
+    wait times for a TimedQueuePool
+'''
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow()
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.wait_stats())
+    return stats
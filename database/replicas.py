@@ -0,0 +1,112 @@
+"""
+Read/write splitting.
+
+DATABASE_REPLICA_URIS=uri1,uri2 adds one engine per read replica (binds
+replica_0, replica_1, ...). Each GET or HEAD request is assigned one
+replica, in turn, and all of its queries go there, so the COUNT, the page
+rows and the ETag versions of one response agree with each other.
+Everything else, including every flush from Base.insert/update/delete and
+any query outside a request, goes to the primary.
+
+Replicas lag the primary, so a client that just wrote gets a short lived
+cookie (REPLICA_PIN_SECONDS, default 5) and its reads stay on the primary
+until it expires, so it always sees its own writes. Pinned requests also
+bypass the response cache (see cache.cached), which other clients may
+fill from a lagging replica.
+"""
+import itertools
+import os
+import time
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from database.pool import engine_options
+
+REPLICA_BIND_PREFIX = "replica_"
+PIN_COOKIE = "db_primary_until"
+READ_METHODS = ("GET", "HEAD")
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+replica_uris = [uri.strip() for uri in
+                os.environ.get("DATABASE_REPLICA_URIS", "").split(",")
+                if uri.strip()]
+next_replica = itertools.count()
+
+
+def replica_binds(uris):
+    return {f"{REPLICA_BIND_PREFIX}{i}": {"url": uri, **engine_options(uri)}
+            for i, uri in enumerate(uris)}
+
+
+def replica_engines(engines):
+    return [engines[key] for key in sorted(engines, key=str)
+            if isinstance(key, str) and key.startswith(REPLICA_BIND_PREFIX)]
+
+
+'''
+pinned_to_primary()
+    True while the client of the current request is within
+    REPLICA_PIN_SECONDS of its last write
+'''
+def pinned_to_primary():
+    if not has_request_context():
+        return False
+    pinned_until = request.cookies.get(PIN_COOKIE, type=float)
+    return pinned_until is not None and pinned_until >= time.time()
+
+
+'''
+use_replica()
+    True while handling a read request from a client that is not pinned to
+    the primary
+'''
+def use_replica():
+    if not has_request_context() or request.method not in READ_METHODS:
+        return False
+    return not pinned_to_primary()
+
+
+'''
+request_replica(replicas)
+    the replica of the current request, picked round robin on first use
+'''
+def request_replica(replicas):
+    if "db_replica" not in g:
+        g.db_replica = replicas[next(next_replica) % len(replicas)]
+    return g.db_replica
+
+
+'''
+RoutingSession
+    db.session class that sends reads to the request's replica when
+    use_replica() allows it, and flushes plus all other statements to the
+    primary
+'''
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and use_replica():
+            replicas = replica_engines(self._db.engines)
+            if replicas:
+                return request_replica(replicas)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+'''
+init_replicas(app)
+    pins clients to the primary for REPLICA_PIN_SECONDS after a successful
+    write request (OPTIONS preflights and failed writes do not pin)
+'''
+def init_replicas(app):
+    app.config.setdefault("REPLICA_PIN_SECONDS", int(os.environ.get(
+        "REPLICA_PIN_SECONDS", 5)))
+
+    @app.after_request
+    def pin_primary_after_write(response):
+        engines = current_app.extensions["sqlalchemy"].engines
+        if request.method in WRITE_METHODS and response.status_code < 400 \
+                and replica_engines(engines):
+            seconds = current_app.config["REPLICA_PIN_SECONDS"]
+            response.set_cookie(PIN_COOKIE, str(time.time() + seconds),
+                                max_age=seconds, httponly=True,
+                                samesite="Lax")
+        return response
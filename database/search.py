@@ -0,0 +1,98 @@
+"""
+Full-text search over article titles and tags.
+
+Postgres keeps a generated tsvector column (articles.search_vector) with a
+GIN index. SQLite keeps an FTS5 external content table (articles_fts) fed by
+triggers. Either way the index is written by the database in the same
+transaction as the article row, including bulk writes. Other dialects fall
+back to an ILIKE scan.
+
+The DDL runs after db.create_all() creates the articles table; existing
+databases get it from the migration.
+"""
+import re
+from sqlalchemy import DDL, column, event, func, literal, literal_column, table
+from database.models import db, Article
+
+articles_fts = table("articles_fts", column("rowid"))
+
+POSTGRES_DDL = [
+    """ALTER TABLE articles ADD COLUMN search_vector tsvector
+       GENERATED ALWAYS AS (
+           setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+           setweight(to_tsvector('english',
+                                 replace(coalesce(tags, ''), ',', ' ')), 'B')
+       ) STORED""",
+    """CREATE INDEX ix_articles_search_vector ON articles
+       USING GIN (search_vector)""",
+]
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE articles_fts USING fts5(
+           title, tags, content='articles', content_rowid='id')""",
+    """CREATE TRIGGER articles_fts_insert AFTER INSERT ON articles BEGIN
+           INSERT INTO articles_fts(rowid, title, tags)
+           VALUES (new.id, new.title, new.tags);
+       END""",
+    """CREATE TRIGGER articles_fts_delete AFTER DELETE ON articles BEGIN
+           INSERT INTO articles_fts(articles_fts, rowid, title, tags)
+           VALUES ('delete', old.id, old.title, old.tags);
+       END""",
+    """CREATE TRIGGER articles_fts_update AFTER UPDATE OF title, tags
+       ON articles BEGIN
+           INSERT INTO articles_fts(articles_fts, rowid, title, tags)
+           VALUES ('delete', old.id, old.title, old.tags);
+           INSERT INTO articles_fts(rowid, title, tags)
+           VALUES (new.id, new.title, new.tags);
+       END""",
+]
+
+for statement in POSTGRES_DDL:
+    event.listen(Article.__table__, "after_create",
+                 DDL(statement).execute_if(dialect="postgresql"))
+for statement in SQLITE_DDL:
+    event.listen(Article.__table__, "after_create",
+                 DDL(statement).execute_if(dialect="sqlite"))
+
+
+def search_terms(q):
+    return re.findall(r"\w+", q.lower())
+
+
+'''
+search_articles(q)
+    returns a projected query of (id, title, tags, rank) for articles
+    matching every term of q, and the rank column to sort by (descending)
+'''
+def search_articles(q):
+    dialect = db.engine.dialect.name
+    columns = Article.short_columns()
+
+    if dialect == "postgresql":
+        # same semantics as sqlite: every term, prefix matched
+        tsquery = func.to_tsquery("english", " & ".join(
+            "{}:*".format(term) for term in search_terms(q)))
+        vector = literal_column("articles.search_vector")
+        rank = func.ts_rank(vector, tsquery).label("rank")
+        query = db.session.query(*columns, rank)\
+            .filter(vector.op("@@")(tsquery))
+        return query, rank
+
+    if dialect == "sqlite":
+        # each term is quoted and prefix matched, terms are ANDed
+        match = " ".join('"{}"*'.format(term) for term in search_terms(q))
+        # bm25 is lower for better matches, title hits weigh 10x tags
+        rank = (-func.bm25(literal_column("articles_fts"), 10.0, 1.0))\
+            .label("rank")
+        query = db.session.query(*columns, rank)\
+            .select_from(Article)\
+            .join(articles_fts, articles_fts.c.rowid == Article.id)\
+            .filter(literal_column("articles_fts").op("MATCH")(match))
+        return query, rank
+
+    rank = literal(0).label("rank")
+    query = db.session.query(*columns, rank)
+    for term in search_terms(q):
+        query = query.filter(Article.title.ilike(f"%{term}%")
+                             | Article.tags.ilike(f"%{term}%"))
+    return query, rank
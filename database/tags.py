@@ -0,0 +1,194 @@
+"""
+Normalized tag storage.
+
+Tag names are split out of Article.tags, stored once in the tags table and
+linked to articles through article_tags. Single row writes are kept in sync
+by mapper events running in the same flush (and transaction) as the article
+write; the bulk routes call set_article_tags() directly for whole batches.
+
+Tag.article_count is adjusted by the same code whenever links are added or
+removed, so GET /tags never has to count. rebuild-tag-counts recomputes it.
+"""
+from collections import Counter
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, event, func, inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from database.models import db, Article, Tag, article_tags
+
+tags_table = Tag.__table__
+
+
+def split_tags(tags):
+    names = [name.strip().lower() for name in (tags or "").split(",")]
+    return list(dict.fromkeys(name for name in names if name))
+
+
+'''
+INSERT of new tags that skips names another writer inserted first
+'''
+def insert_missing_tags(connection):
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(tags_table)\
+            .on_conflict_do_nothing(index_elements=["name"])
+    if dialect == "sqlite":
+        return sqlite.insert(tags_table)\
+            .on_conflict_do_nothing(index_elements=["name"])
+    return tags_table.insert()
+
+
+'''
+Resolve tag names to ids
+    creates the missing tags, returns a dict of name -> id. Concurrent
+    writers may introduce the same new tag, the conflicting INSERT is then
+    skipped and the re-select finds the other writer's row.
+'''
+def tag_ids(connection, names):
+    if not names:
+        return {}
+    query = select(tags_table.c.name, tags_table.c.id)\
+        .where(tags_table.c.name.in_(names))
+    ids = dict(connection.execute(query).all())
+    missing = [{"name": name} for name in names if name not in ids]
+    if missing:
+        connection.execute(insert_missing_tags(connection), missing)
+        ids = dict(connection.execute(query).all())
+    return ids
+
+
+'''
+set_article_tags(connection, tags_by_article)
+    makes the article_tags links of each article match its tags string,
+    tags_by_article maps article id -> comma joined tags. Only the links
+    that changed are deleted or inserted.
+'''
+def set_article_tags(connection, tags_by_article):
+    if not tags_by_article:
+        return
+    current = set(connection.execute(
+        select(article_tags.c.article_id, article_tags.c.tag_id)
+        .where(article_tags.c.article_id.in_(list(tags_by_article)))).all())
+
+    names = {id: split_tags(tags) for id, tags in tags_by_article.items()}
+    ids = tag_ids(connection, list({name for article_names in names.values()
+                                    for name in article_names}))
+    wanted = {(article_id, ids[name])
+              for article_id, article_names in names.items()
+              for name in article_names}
+
+    removed = current - wanted
+    added = wanted - current
+    update_counts(connection, removed, added)
+    if removed:
+        connection.execute(
+            article_tags.delete()
+            .where(article_tags.c.article_id == bindparam("b_article_id"))
+            .where(article_tags.c.tag_id == bindparam("b_tag_id")),
+            [{"b_article_id": article_id, "b_tag_id": tag_id}
+             for article_id, tag_id in removed])
+    if added:
+        connection.execute(article_tags.insert(), [
+            {"article_id": article_id, "tag_id": tag_id}
+            for article_id, tag_id in added])
+
+
+def remove_article_tags(connection, article_ids):
+    links = set(connection.execute(
+        select(article_tags.c.article_id, article_tags.c.tag_id)
+        .where(article_tags.c.article_id.in_(article_ids))).all())
+    if links:
+        update_counts(connection, links, ())
+        connection.execute(article_tags.delete()
+                           .where(article_tags.c.article_id.in_(article_ids)))
+
+
+'''
+Adjust Tag.article_count
+    removed and added are (article_id, tag_id) links, tags with the same
+    change share one executemany UPDATE
+'''
+def update_counts(connection, removed, added):
+    deltas = Counter(tag_id for _, tag_id in added)
+    deltas.subtract(tag_id for _, tag_id in removed)
+    by_delta = {}
+    for tag_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append({"b_id": tag_id})
+    for delta, params in by_delta.items():
+        connection.execute(
+            tags_table.update()
+            .where(tags_table.c.id == bindparam("b_id"))
+            .values(article_count=tags_table.c.article_count + delta),
+            params)
+
+
+'''
+rebuild_tag_counts(relink=False)
+    repairs drift: with relink the article_tags links are first rebuilt
+    from Article.tags in batches, then every count is recomputed from the
+    links with a single UPDATE
+'''
+def rebuild_tag_counts(relink=False, batch_size=1000):
+    connection = db.session.connection()
+    if relink:
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                select(Article.id, Article.tags).where(Article.id > last_id)
+                .order_by(Article.id).limit(batch_size)).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            set_article_tags(connection, dict(rows))
+
+    links = select(func.count(article_tags.c.article_id))\
+        .where(article_tags.c.tag_id == tags_table.c.id)\
+        .scalar_subquery()
+    connection.execute(tags_table.update().values(article_count=links))
+    db.session.commit()
+
+
+@click.command("rebuild-tag-counts")
+@click.option("--relink", is_flag=True,
+              help="Rebuild article_tags from articles.tags first.")
+@with_appcontext
+def rebuild_tag_counts_command(relink):
+    """Recompute tag article counts."""
+    rebuild_tag_counts(relink)
+    click.echo("Tag counts rebuilt.")
+
+
+@event.listens_for(Article, "after_insert")
+def article_inserted(mapper, connection, target):
+    set_article_tags(connection, {target.id: target.tags})
+
+
+@event.listens_for(Article, "after_update")
+def article_updated(mapper, connection, target):
+    if inspect(target).attrs.tags.history.has_changes():
+        set_article_tags(connection, {target.id: target.tags})
+
+
+@event.listens_for(Article, "before_delete")
+def article_deleted(mapper, connection, target):
+    remove_article_tags(connection, [target.id])
+
+
+'''
+Filter an article query by tag
+    mode "all" keeps articles carrying every tag, "any" articles carrying at
+    least one. Both resolve through the tags.name and article_tags indexes.
+'''
+def filter_by_tags(query, names, mode="all"):
+    names = list(dict.fromkeys(name.strip().lower() for name in names
+                               if name.strip()))
+    if not names:
+        return query
+    matches = select(article_tags.c.article_id)\
+        .join(tags_table, tags_table.c.id == article_tags.c.tag_id)\
+        .where(tags_table.c.name.in_(names))
+    if mode == "all":
+        matches = matches.group_by(article_tags.c.article_id)\
+            .having(func.count(article_tags.c.tag_id) == len(names))
+    return query.filter(Article.id.in_(matches))
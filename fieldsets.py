@@ -0,0 +1,57 @@
+"""
+Sparse fieldsets: ?fields=id,title,author_id
+
+Every route that returns articles, authors or publishers accepts ?fields=
+with names from the model's field_columns allow-list (the keys of its
+format() dict). Only the columns those fields are built from are selected,
+so e.g. article_link is never read unless it was asked for. The "articles"
+field of authors and publishers is loaded with one extra query for all the
+rows of the response.
+"""
+from flask import abort
+from database.models import db, Article
+
+
+'''
+Parse ?fields=
+    returns the requested field names in request order, or None when the
+    argument is absent. Unknown fields abort with 400.
+'''
+def get_fields_arg(request, model):
+    if "fields" not in request.args:
+        return None
+    fields = list(dict.fromkeys(
+        field.strip() for field in request.args["fields"].split(",")
+        if field.strip()))
+    if not fields or any(field not in model.field_columns
+                         for field in fields):
+        abort(400)
+    return fields
+
+
+'''
+article_titles(model, ids)
+    id and title of the articles of every given author / publisher id,
+    grouped by parent id, in one query
+'''
+def article_titles(model, ids):
+    parent_id = getattr(Article, model.article_parent_key)
+    titles = {id: [] for id in ids}
+    rows = db.session.query(parent_id, Article.id, Article.title)\
+        .filter(parent_id.in_(ids)).order_by(Article.id)
+    for parent, article_id, title in rows:
+        titles[parent].append({"article_id": article_id, "title": title})
+    return titles
+
+
+'''
+format_rows(model, rows, fields)
+    shapes rows of model.fieldset_query(fields) into response dicts
+'''
+def format_rows(model, rows, fields):
+    titles = {}
+    if "articles" in fields and rows:
+        titles = article_titles(model, [row.id for row in rows])
+    return [{field: titles[row.id] if field == "articles"
+             else model.format_field(row, field) for field in fields}
+            for row in rows]
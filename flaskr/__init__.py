@@ -5,27 +5,34 @@ import sys
 from os import path
 sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
 from database.models import *
-from auth.auth import requires_auth
+from auth.auth import requires_auth, jwks_cache, token_cache
 import error_handlers
+from cache import init_cache, cached, get_cache
+from conditional import conditional
+from database.bulk import bulk_create, bulk_upsert, MAX_BULK_ITEMS
+from database.tags import filter_by_tags, rebuild_tag_counts_command
+from database.pool import pool_stats
+from database.replicas import init_replicas, replica_engines
+from database.search import search_articles, search_terms
+from json_provider import init_json
+from compression import init_compression
+from warmup import init_warmup
+from pagination import paginate_results, get_ids_arg, get_sort_arg, \
+    is_keyset_request
+from fieldsets import get_fields_arg, format_rows
+from includes import get_include_arg, include_columns, included
 
 
-MAX_RESULTS_PER_PAGE = 10
-
-def paginate_results(request, selection):
-    page = request.args.get("page", 1, type=int)
-    start = (page - 1) * MAX_RESULTS_PER_PAGE
-    end = start + MAX_RESULTS_PER_PAGE
-    
-    results = [model.format_short() for model in selection]
-    current_results = results[start:end]
-    
-    return current_results
-
 def create_app(test_config=None):
 
     app = Flask(__name__)
+    init_json(app)
     setup_db(app)
+    init_replicas(app)
+    init_cache(app)
+    init_compression(app)
     app.register_blueprint(error_handlers.blueprint)
+    app.cli.add_command(rebuild_tag_counts_command)
     CORS(app)
     
     # CORS Headers
@@ -48,40 +55,141 @@ def create_app(test_config=None):
     def get_greeting():
         return "Application is up and running!"
 
+    @app.route('/metrics')
+    def get_metrics():
+        cache = get_cache()
+        return jsonify({
+            "success": True,
+            "cache": cache.stats() if cache else None,
+            "jwks": jwks_cache.stats(),
+            "tokens": token_cache.stats(),
+            "pool": pool_stats(db.engine),
+            "replica_pools": [pool_stats(engine)
+                              for engine in replica_engines(db.engines)]
+        })
+
     '''
     ROUTES:Articles ---------------
     '''
     @app.route('/articles', methods=["GET"])
     # @requires_auth('get:all')
+    @cached('articles')
+    @conditional(Article)
     def get_articles():
-        articles = paginate_results(request, Article.query.all())
+        fields = get_fields_arg(request, Article)
+        includes = get_include_arg(request)
+        ids = get_ids_arg(request)
+        if ids is not None and fields is not None:
+            found = {row.id: row for row in Article.fieldset_query(
+                fields, include_columns(includes))
+                .filter(Article.id.in_(ids))}
+            rows = [found[id] for id in ids if id in found]
+            return jsonify({
+                "success": True,
+                "articles": format_rows(Article, rows, fields),
+                "missing": [id for id in ids if id not in found],
+                **included(includes, rows)
+            })
+        if ids is not None:
+            found = Article.get_many(ids)
+            rows = [found[id] for id in ids if id in found]
+            return jsonify({
+                "success": True,
+                "articles": [row.format() for row in rows],
+                "missing": [id for id in ids if id not in found],
+                **included(includes, rows)
+            })
+
+        sort_columns, descending = get_sort_arg(
+            request, Article, ("id", "title"))
+        if fields is None:
+            query = Article.short_query()\
+                .add_columns(*include_columns(includes))
+        else:
+            query = Article.fieldset_query(
+                fields, sort_columns + include_columns(includes))
+        if request.args.get("tag"):
+            tag_mode = request.args.get("tag_mode", "all")
+            if tag_mode not in ("all", "any"):
+                abort(400)
+            query = filter_by_tags(query, request.args.getlist("tag"), tag_mode)
+        for field in ("author_id", "publisher_id"):
+            if field in request.args:
+                value = request.args.get(field, type=int)
+                if value is None:
+                    abort(400)
+                query = query.filter(getattr(Article, field) == value)
+
+        rows, page = paginate_results(
+            request, query, sort_columns, None, descending=descending)
+        if fields is None:
+            articles = [Article.format_short_row(row) for row in rows]
+        else:
+            articles = format_rows(Article, rows, fields)
         
         if not len(articles):
             abort(404)
         
         return jsonify({
             "success": True,
-            "articles": articles
+            "articles": articles,
+            **page,
+            **included(includes, rows)
         })
 
     
+    @app.route('/articles/search', methods=["GET"])
+    @cached('articles')
+    @conditional(Article)
+    def get_article_search_results():
+        q = request.args.get("q", "")
+        if not search_terms(q) or is_keyset_request(request):
+            abort(400)
+
+        query, rank = search_articles(q)
+        articles, page = paginate_results(
+            request, query, [rank, Article.id], Article.format_short_row,
+            descending=True)
+
+        return jsonify({
+            "success": True,
+            "articles": articles,
+            **page
+        })
+
     @app.route('/articles/<int:article_id>', methods=["GET"])
+    @cached('articles')
+    @conditional(Article)
     def get_article_details(article_id):
-        article = Article.query.filter(Article.id == article_id).one_or_none()
+        fields = get_fields_arg(request, Article)
+        includes = get_include_arg(request)
+        if fields is not None:
+            row = Article.fieldset_query(fields, include_columns(includes))\
+                .filter(Article.id == article_id).one_or_none()
+            if not row:
+                abort(404)
+            return jsonify({
+                "success": True,
+                "article": format_rows(Article, [row], fields)[0],
+                **included(includes, [row])
+            })
+
+        article = Article.detail_query()\
+            .filter(Article.id == article_id).one_or_none()
         
         if not article:
             abort(404)
             
         return jsonify({
             "success": True,
-            "article": article.format()
+            "article": article.format(),
+            **included(includes, [article])
         })
     
     @app.route('/articles', methods=["POST"])
     @requires_auth('post:articles')
     def create_article(payload):
         body = request.get_json(force=True)
-        print(",".join(body.get("tags")))
         try:
             new_article = Article(
                 title=body.get("title"),
@@ -99,10 +207,36 @@ def create_app(test_config=None):
             })
             
         except Exception as e:
-            print(e.args)
+            app.logger.debug("rejected write: %s", e.args)
             abort(422)
             
     
+    @app.route('/articles/bulk', methods=["POST"])
+    @requires_auth('post:articles')
+    def create_articles_bulk(payload):
+        body = request.get_json(force=True)
+        if not isinstance(body, list) or not body \
+                or len(body) > MAX_BULK_ITEMS:
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            **bulk_create(Article, body)
+        })
+
+    @app.route('/articles/bulk', methods=["PATCH"])
+    @requires_auth('patch:articles')
+    def upsert_articles_bulk(payload):
+        body = request.get_json(force=True)
+        if not isinstance(body, list) or not body \
+                or len(body) > MAX_BULK_ITEMS:
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            **bulk_upsert(Article, body)
+        })
+
     @app.route('/articles/<int:article_id>', methods=["PATCH"])
     @requires_auth('patch:articles')
     def edit_article(payload,article_id):
@@ -115,9 +249,9 @@ def create_app(test_config=None):
         body = request.get_json(force=True)
         
         try:   
-            article_to_update.title=body.get("title"),
-            article_to_update.publisher_id=body.get("publisher_id"),
-            article_to_update.author_id=body.get("author_id"),
+            article_to_update.title=body.get("title")
+            article_to_update.publisher_id=body.get("publisher_id")
+            article_to_update.author_id=body.get("author_id")
             article_to_update.tags=",".join(body.get("tags"))
             
             article_to_update.update()
@@ -151,24 +285,90 @@ def create_app(test_config=None):
             abort(abort_code)
         
 
+    '''
+    ROUTES:Tags ---------------
+    '''
+    @app.route('/tags', methods=["GET"])
+    @cached('tags')
+    @conditional(Tag)
+    def get_tags():
+        tags, page = paginate_results(
+            request, Tag.short_query(), [Tag.article_count, Tag.id],
+            Tag.format_short_row, descending=True)
+
+        if not len(tags):
+            abort(404)
+
+        return jsonify({
+            "success": True,
+            "tags": tags,
+            **page
+        })
+
     '''
     ROUTES:Authors ---------------
     '''
     @app.route('/authors', methods=["GET"])
+    @cached('authors')
+    @conditional(Author)
     def get_authors():
-        authors = paginate_results(request, Author.query.all())
+        fields = get_fields_arg(request, Author)
+        ids = get_ids_arg(request)
+        if ids is not None and fields is not None:
+            found = {row.id: row for row in Author.fieldset_query(fields)
+                     .filter(Author.id.in_(ids))}
+            return jsonify({
+                "success": True,
+                "authors": format_rows(
+                    Author, [found[id] for id in ids if id in found], fields),
+                "missing": [id for id in ids if id not in found]
+            })
+        if ids is not None:
+            found = Author.get_many(ids)
+            return jsonify({
+                "success": True,
+                "authors": [found[id].format() for id in ids if id in found],
+                "missing": [id for id in ids if id not in found]
+            })
+
+        sort_columns, descending = get_sort_arg(
+            request, Author, ("id", "lastname"))
+        if fields is None:
+            authors, page = paginate_results(
+                request, Author.short_query(), sort_columns,
+                Author.format_short_row, descending=descending)
+        else:
+            rows, page = paginate_results(
+                request, Author.fieldset_query(fields, sort_columns),
+                sort_columns, None, descending=descending)
+            authors = format_rows(Author, rows, fields)
         
         if not len(authors):
             abort(404)
         
         return jsonify({
             "success": True,
-            "authors": authors
+            "authors": authors,
+            **page
         })
         
     @app.route('/authors/<int:author_id>', methods=["GET"])
+    @cached('authors')
+    @conditional(Author)
     def get_author_details(author_id):
-        author = Author.query.filter(Author.id == author_id).one_or_none()
+        fields = get_fields_arg(request, Author)
+        if fields is not None:
+            row = Author.fieldset_query(fields)\
+                .filter(Author.id == author_id).one_or_none()
+            if not row:
+                abort(404)
+            return jsonify({
+                "success": True,
+                "author": format_rows(Author, [row], fields)[0]
+            })
+
+        author = Author.detail_query()\
+            .filter(Author.id == author_id).one_or_none()
         
         if not author:
             abort(404)
@@ -194,6 +394,19 @@ def create_app(test_config=None):
         except:
             abort(422)
     
+    @app.route('/authors/bulk', methods=["POST"])
+    @requires_auth('post:authors')
+    def create_authors_bulk(payload):
+        body = request.get_json(force=True)
+        if not isinstance(body, list) or not body \
+                or len(body) > MAX_BULK_ITEMS:
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            **bulk_create(Author, body)
+        })
+
     @app.route('/authors/<int:author_id>', methods=["PATCH"])
     @requires_auth('patch:authors')
     def edit_author_details(payload, author_id):
@@ -247,20 +460,66 @@ def create_app(test_config=None):
     ROUTES:Publisher ---------------
     '''
     @app.route('/publishers', methods=["GET"])
+    @cached('publishers')
+    @conditional(Publisher)
     def get_publishers():
-        publishers =  paginate_results(request,Publisher.query.all())
+        fields = get_fields_arg(request, Publisher)
+        ids = get_ids_arg(request)
+        if ids is not None and fields is not None:
+            found = {row.id: row for row in Publisher.fieldset_query(fields)
+                     .filter(Publisher.id.in_(ids))}
+            return jsonify({
+                "success": True,
+                "publishers": format_rows(
+                    Publisher, [found[id] for id in ids if id in found], fields),
+                "missing": [id for id in ids if id not in found]
+            })
+        if ids is not None:
+            found = Publisher.get_many(ids)
+            return jsonify({
+                "success": True,
+                "publishers": [found[id].format() for id in ids if id in found],
+                "missing": [id for id in ids if id not in found]
+            })
+
+        sort_columns, descending = get_sort_arg(
+            request, Publisher, ("id", "name"))
+        if fields is None:
+            publishers, page = paginate_results(
+                request, Publisher.short_query(), sort_columns,
+                Publisher.format_short_row, descending=descending)
+        else:
+            rows, page = paginate_results(
+                request, Publisher.fieldset_query(fields, sort_columns),
+                sort_columns, None, descending=descending)
+            publishers = format_rows(Publisher, rows, fields)
 
         if not len(publishers):
             abort(404)
         
         return jsonify({
             "success": True,
-            "publishers": publishers
+            "publishers": publishers,
+            **page
         })
     
     @app.route('/publishers/<int:publisher_id>', methods=["GET"])
+    @cached('publishers')
+    @conditional(Publisher)
     def get_publisher_details(publisher_id):
-        publisher = Publisher.query.filter(Publisher.id == publisher_id).one_or_none()
+        fields = get_fields_arg(request, Publisher)
+        if fields is not None:
+            row = Publisher.fieldset_query(fields)\
+                .filter(Publisher.id == publisher_id).one_or_none()
+            if not row:
+                abort(404)
+            return jsonify({
+                "success": True,
+                "publisher": format_rows(Publisher, [row], fields)[0]
+            })
+
+        publisher = Publisher.detail_query()\
+            .filter(Publisher.id == publisher_id).one_or_none()
         
         if not publisher:
             abort(404)
@@ -285,10 +544,23 @@ def create_app(test_config=None):
             })
             
         except Exception as e:
-            print(e.args)
+            app.logger.debug("rejected write: %s", e.args)
             abort(422)
         
     
+    @app.route('/publishers/bulk', methods=["POST"])
+    @requires_auth('post:publishers')
+    def create_publishers_bulk(payload):
+        body = request.get_json(force=True)
+        if not isinstance(body, list) or not body \
+                or len(body) > MAX_BULK_ITEMS:
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            **bulk_create(Publisher, body)
+        })
+
     @app.route('/publishers/<int:publisher_id>', methods=["PATCH"])
     @requires_auth('patch:publishers')
     def edit_publisher_details(payload, publisher_id):
@@ -340,6 +612,5 @@ def create_app(test_config=None):
     """
     %%%%%%% ---------- END ---------- %%%%%%%
     """
+    init_warmup(app)
     return app
-
-app = create_app()
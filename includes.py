@@ -0,0 +1,63 @@
+"""
+Compound documents: ?include=author,publisher
+
+The article routes can embed the author and publisher of the articles they
+return, so a client needs one request instead of 1 + 2N. The related rows
+of the whole response are read with one IN query per relation and returned
+once each under "included", in short format:
+
+    {"articles": [...], "included": {"authors": [...], "publishers": [...]}}
+"""
+from flask import abort
+from database.models import db, Article, Author, Publisher
+
+# include name -> (Article foreign key, related model, key in "included")
+INCLUDES = {
+    "author": ("author_id", Author, "authors"),
+    "publisher": ("publisher_id", Publisher, "publishers"),
+}
+
+
+'''
+Parse ?include=
+    returns the requested relation names, or None when the argument is
+    absent. Unknown names abort with 400.
+'''
+def get_include_arg(request):
+    if "include" not in request.args:
+        return None
+    includes = list(dict.fromkeys(
+        name.strip() for name in request.args["include"].split(",")
+        if name.strip()))
+    if not includes or any(name not in INCLUDES for name in includes):
+        abort(400)
+    return includes
+
+
+'''
+include_columns(includes)
+    the Article foreign key columns a projected query must select for the
+    requested includes
+'''
+def include_columns(includes):
+    return [getattr(Article, INCLUDES[name][0]) for name in includes or ()]
+
+
+'''
+included(includes, rows)
+    the "included" part of the response for article rows or instances,
+    an empty dict when nothing was requested
+'''
+def included(includes, rows):
+    if includes is None:
+        return {}
+    result = {}
+    for name in includes:
+        key, model, collection = INCLUDES[name]
+        ids = {getattr(row, key) for row in rows} - {None}
+        related = []
+        if ids:
+            related = db.session.query(*model.short_columns())\
+                .filter(model.id.in_(ids)).order_by(model.id)
+        result[collection] = [model.format_short_row(row) for row in related]
+    return {"included": result}
@@ -0,0 +1,56 @@
+"""
+JSON provider for the API responses.
+
+Serializes with orjson when it is installed and with Flask's stdlib based
+provider otherwise. The orjson output keeps Flask's conventions (sorted keys,
+compact separators, indent=2 in debug mode, dates as HTTP dates) and parses
+to the same values. The bytes differ only in that non-ASCII characters are
+written as UTF-8 instead of \\u escapes and floats with exponents drop the
+"+" (1e20). Anything orjson cannot encode falls back to the stdlib.
+
+JSON_PROVIDER=stdlib forces the stdlib encoder.
+"""
+import os
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    options = 0
+    if orjson is not None:
+        options = orjson.OPT_PASSTHROUGH_DATETIME \
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def dumps(self, obj, **kwargs):
+        # the two forms DefaultJSONProvider.response uses
+        compact = kwargs == {"separators": (",", ":")}
+        pretty = kwargs == {"indent": 2}
+        if not (compact or pretty):
+            return super().dumps(obj, **kwargs)
+
+        options = self.options
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=_default,
+                                option=options).decode()
+        except TypeError:
+            # e.g. integers wider than 64 bits or non-str keys
+            return super().dumps(obj, **kwargs)
+
+
+'''
+init_json(app)
+    installs the fastest available JSON provider on the app
+'''
+def init_json(app):
+    app.config.setdefault("JSON_PROVIDER", os.environ.get(
+        "JSON_PROVIDER", "orjson"))
+    if app.config["JSON_PROVIDER"] == "orjson" and orjson is not None:
+        app.json = OrjsonProvider(app)
@@ -0,0 +1,52 @@
+"""initial schema
+
+Tables as created by db.create_all() before migrations were introduced.
+Databases created that way should be stamped with this revision
+(flask db stamp 1310fbf8dc2d) before running flask db upgrade.
+
+Revision ID: 1310fbf8dc2d
+Revises: 
+Create Date: 2026-10-18 09:12:41.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1310fbf8dc2d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('authors',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('names', sa.String(length=80), nullable=False),
+    sa.Column('lastname', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('publishers',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('company_link', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('articles',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=120), nullable=False),
+    sa.Column('article_link', sa.String(length=250), nullable=False),
+    sa.Column('tags', sa.String(length=250), nullable=False),
+    sa.Column('publisher_id', sa.Integer(), nullable=True),
+    sa.Column('author_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['author_id'], ['authors.id'], ),
+    sa.ForeignKeyConstraint(['publisher_id'], ['publishers.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('articles')
+    op.drop_table('publishers')
+    op.drop_table('authors')
@@ -0,0 +1,37 @@
+"""list filter and sort indexes
+
+Revision ID: 2ee82a0d15e2
+Revises: e620b250a929
+Create Date: 2026-10-18 13:48:27.905163
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2ee82a0d15e2'
+down_revision = 'e620b250a929'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_articles_author_id_id', 'articles',
+                    ['author_id', 'id'], unique=False)
+    op.create_index('ix_articles_publisher_id_id', 'articles',
+                    ['publisher_id', 'id'], unique=False)
+    op.create_index('ix_articles_title_id', 'articles',
+                    ['title', 'id'], unique=False)
+    op.create_index('ix_authors_lastname_id', 'authors',
+                    ['lastname', 'id'], unique=False)
+    op.create_index('ix_publishers_name_id', 'publishers',
+                    ['name', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_publishers_name_id', table_name='publishers')
+    op.drop_index('ix_authors_lastname_id', table_name='authors')
+    op.drop_index('ix_articles_title_id', table_name='articles')
+    op.drop_index('ix_articles_publisher_id_id', table_name='articles')
+    op.drop_index('ix_articles_author_id_id', table_name='articles')
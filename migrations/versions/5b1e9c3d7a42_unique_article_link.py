@@ -0,0 +1,35 @@
+"""unique article link
+
+Revision ID: 5b1e9c3d7a42
+Revises: 2ee82a0d15e2
+Create Date: 2026-10-18 16:05:12.418337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e9c3d7a42'
+down_revision = '2ee82a0d15e2'
+branch_labels = None
+depends_on = None
+
+# every article but the oldest of each article_link
+DUPLICATES = (
+    "SELECT id FROM articles WHERE id NOT IN "
+    "(SELECT min(id) FROM articles GROUP BY article_link)")
+
+
+def upgrade():
+    op.execute(f"DELETE FROM article_tags WHERE article_id IN ({DUPLICATES})")
+    op.execute(f"DELETE FROM articles WHERE id IN ({DUPLICATES})")
+    op.execute(
+        "UPDATE tags SET article_count = (SELECT count(*) FROM article_tags "
+        "WHERE article_tags.tag_id = tags.id)")
+    op.create_index('ux_articles_article_link', 'articles',
+                    ['article_link'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ux_articles_article_link', table_name='articles')
@@ -0,0 +1,72 @@
+"""normalized tags
+
+Adds the tags and article_tags tables and backfills them from the comma
+joined articles.tags column.
+
+Revision ID: 75c408712538
+Revises: c33030c606a4
+Create Date: 2026-10-18 11:05:27.918342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '75c408712538'
+down_revision = 'c33030c606a4'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    tags = op.create_table('tags',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=250), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    article_tags = op.create_table('article_tags',
+    sa.Column('article_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['article_id'], ['articles.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('article_id', 'tag_id')
+    )
+    op.create_index('ix_article_tags_tag_id_article_id', 'article_tags',
+                    ['tag_id', 'article_id'], unique=False)
+
+    # backfill, walking articles by id in batches
+    connection = op.get_bind()
+    articles = sa.table('articles', sa.column('id', sa.Integer),
+                        sa.column('tags', sa.String))
+    tag_ids = {}
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(articles.c.id, articles.c.tags)
+            .where(articles.c.id > last_id)
+            .order_by(articles.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        links = []
+        for row in rows:
+            names = [name.strip().lower() for name in (row.tags or "").split(",")]
+            for name in dict.fromkeys(name for name in names if name):
+                if name not in tag_ids:
+                    connection.execute(tags.insert().values(name=name))
+                    tag_ids[name] = connection.execute(
+                        sa.select(tags.c.id).where(tags.c.name == name)).scalar()
+                links.append({"article_id": row.id, "tag_id": tag_ids[name]})
+        if links:
+            connection.execute(article_tags.insert(), links)
+
+
+def downgrade():
+    op.drop_index('ix_article_tags_tag_id_article_id', table_name='article_tags')
+    op.drop_table('article_tags')
+    op.drop_table('tags')
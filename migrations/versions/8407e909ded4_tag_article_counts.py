@@ -0,0 +1,33 @@
+"""tag article counts
+
+Revision ID: 8407e909ded4
+Revises: 75c408712538
+Create Date: 2026-10-18 12:31:50.602114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8407e909ded4'
+down_revision = '75c408712538'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tags') as batch_op:
+        batch_op.add_column(sa.Column('article_count', sa.Integer(),
+                                      server_default='0', nullable=False))
+        batch_op.create_index('ix_tags_article_count', ['article_count'],
+                              unique=False)
+    op.execute(
+        "UPDATE tags SET article_count = (SELECT count(*) FROM article_tags "
+        "WHERE article_tags.tag_id = tags.id)")
+
+
+def downgrade():
+    with op.batch_alter_table('tags') as batch_op:
+        batch_op.drop_index('ix_tags_article_count')
+        batch_op.drop_column('article_count')
@@ -0,0 +1,31 @@
+"""add row version columns
+
+Revision ID: c33030c606a4
+Revises: 1310fbf8dc2d
+Create Date: 2026-10-18 09:40:03.551872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c33030c606a4'
+down_revision = '1310fbf8dc2d'
+branch_labels = None
+depends_on = None
+
+TABLES = ['authors', 'publishers', 'articles']
+
+
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(),
+                                          server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
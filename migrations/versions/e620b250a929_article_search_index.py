@@ -0,0 +1,40 @@
+"""article search index
+
+Revision ID: e620b250a929
+Revises: 8407e909ded4
+Create Date: 2026-10-18 13:05:12.418337
+
+"""
+from alembic import op
+
+from database.search import POSTGRES_DDL, SQLITE_DDL
+
+
+# revision identifiers, used by Alembic.
+revision = 'e620b250a929'
+down_revision = '8407e909ded4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for statement in POSTGRES_DDL:
+            op.execute(statement)
+    elif dialect == 'sqlite':
+        for statement in SQLITE_DDL:
+            op.execute(statement)
+        # index the rows that already exist
+        op.execute("INSERT INTO articles_fts(articles_fts) VALUES('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX ix_articles_search_vector")
+        op.execute("ALTER TABLE articles DROP COLUMN search_vector")
+    elif dialect == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            op.execute(f"DROP TRIGGER articles_fts_{trigger}")
+        op.execute("DROP TABLE articles_fts")
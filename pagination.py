@@ -0,0 +1,184 @@
+"""
+Pagination helpers shared by the list routes.
+
+Pages are cut in the database so only the rows on the requested page are
+loaded and formatted. Two modes are supported:
+
+    ?page=N&per_page=M     LIMIT/OFFSET with total count metadata
+    ?cursor=<opaque>       keyset (seek) pagination, constant cost at any depth
+    ?after_id=<id>         keyset pagination starting after a known id
+
+Both modes follow ?sort=key or ?sort=-key (descending) where a route allows
+it. The list routes also accept ?ids=1,2,3 to fetch many rows by id at once.
+"""
+import base64
+import json
+from flask import abort
+from sqlalchemy import tuple_
+
+MAX_RESULTS_PER_PAGE = 10
+PER_PAGE_LIMIT = 100
+MAX_IDS_PER_REQUEST = 100
+
+
+def get_page_args(request):
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        abort(400)
+    per_page = request.args.get("per_page", MAX_RESULTS_PER_PAGE, type=int)
+    per_page = max(1, min(per_page, PER_PAGE_LIMIT))
+    return page, per_page
+
+
+'''
+Parse ?ids=1,2,3
+    returns the ids in request order without duplicates, or None when the
+    argument is absent. Malformed or too many ids abort with 400.
+'''
+def get_ids_arg(request):
+    if "ids" not in request.args:
+        return None
+    try:
+        ids = [int(id) for id in request.args["ids"].split(",") if id.strip()]
+    except ValueError:
+        abort(400)
+    ids = list(dict.fromkeys(ids))
+    if not ids or len(ids) > MAX_IDS_PER_REQUEST:
+        abort(400)
+    return ids
+
+
+'''
+Parse ?sort=key / ?sort=-key
+    sort_keys are the column names the route allows, anything else aborts
+    with 400. Returns the columns to order by, with id appended as a unique
+    tie breaker, and whether to sort descending.
+'''
+def get_sort_arg(request, model, sort_keys=("id",)):
+    sort = request.args.get("sort", "id")
+    descending = sort.startswith("-")
+    key = sort[1:] if descending else sort
+    if key not in sort_keys:
+        abort(400)
+    sort_columns = [getattr(model, key)]
+    if key != "id":
+        sort_columns.append(model.id)
+    return sort_columns, descending
+
+
+def encode_cursor(sort_key, values):
+    raw = json.dumps({"s": sort_key, "k": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+'''
+decode_cursor(sort_key, cursor, count)
+    the sort key values of a cursor made by encode_cursor for the same
+    sort, aborts with 400 unless they are count plain ints, floats or
+    strings, so a forged cursor never reaches the SQL bind parameters
+'''
+def decode_cursor(sort_key, cursor, count):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = data["k"]
+        if data["s"] != sort_key or not isinstance(values, list) \
+                or len(values) != count \
+                or any(type(value) not in (int, float, str)
+                       for value in values):
+            raise ValueError(cursor)
+    except Exception:
+        abort(400)
+    return values
+
+
+def order_by(sort_columns, descending):
+    if descending:
+        return [column.desc() for column in sort_columns]
+    return sort_columns
+
+
+def is_keyset_request(request):
+    return "cursor" in request.args or "after_id" in request.args
+
+
+'''
+Paginate a query
+    @INPUTS
+        request:      the current flask request
+        query:        an unordered (projected) query for the collection
+        sort_columns: columns to order by, the last one must be unique (id)
+        formatter:    turns one row into its response dict, None returns
+                      the rows as they are
+        descending:   sort every column in descending order
+
+    returns the formatted rows of the page and the page metadata
+'''
+def paginate_results(request, query, sort_columns, formatter,
+                     descending=False):
+    if is_keyset_request(request):
+        return paginate_keyset(request, query, sort_columns, formatter,
+                               descending)
+
+    page, per_page = get_page_args(request)
+    total = query.count()
+
+    rows = query.order_by(*order_by(sort_columns, descending))\
+        .limit(per_page).offset((page - 1) * per_page).all()
+    results = [formatter(row) for row in rows] if formatter else rows
+
+    meta = {
+        "page": page,
+        "per_page": per_page,
+        "total": total,
+        "has_next": (page - 1) * per_page + len(results) < total
+    }
+    return results, meta
+
+
+'''
+Keyset pagination
+    seeks past the sort key of the last row the client saw, so the database
+    walks the index from that point instead of skipping OFFSET rows.
+    One extra row is fetched to know whether another page exists.
+'''
+def paginate_keyset(request, query, sort_columns, formatter,
+                    descending=False):
+    _, per_page = get_page_args(request)
+    sort_key = ",".join(column.key for column in sort_columns)
+    if descending:
+        sort_key = "-" + sort_key
+
+    values = None
+    if request.args.get("cursor"):
+        values = decode_cursor(sort_key, request.args["cursor"],
+                               len(sort_columns))
+    elif "after_id" in request.args:
+        after_id = request.args.get("after_id", type=int)
+        if after_id is None or sort_key != "id":
+            abort(400)
+        values = [after_id]
+
+    if values is not None:
+        if descending:
+            query = query.filter(tuple_(*sort_columns) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*sort_columns) > tuple_(*values))
+
+    rows = query.order_by(*order_by(sort_columns, descending))\
+        .limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    next_cursor = None
+    if has_next:
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            sort_key, [getattr(last, column.key) for column in sort_columns])
+
+    meta = {
+        "per_page": per_page,
+        "has_next": has_next,
+        "next_cursor": next_cursor
+    }
+    return ([formatter(row) for row in rows] if formatter else rows), meta
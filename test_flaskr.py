@@ -1,13 +1,188 @@
 import copy
+import gzip
+import http.server
 import os
+import socketserver
+import subprocess
+import tempfile
+import threading
+import time
 import unittest
+import uuid
+from unittest import mock
 import json
 from flask_sqlalchemy import SQLAlchemy
+from jose import jwt
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 import sys
 from os import path
 sys.path.append( path.dirname( path.dirname( path.abspath(__file__) ) ) )
+# the tests reconfigure apps after create_app(), which Flask refuses once an
+# app has handled a request, so warm-up is run explicitly where tested
+os.environ.setdefault("WARMUP", "off")
 from flaskr import create_app
 from database.models import *
+from cache import ResponseCache, get_cache
+from cache.backends import MemoryBackend, RedisBackend
+from database.bulk import upsert_rows
+from database.tags import split_tags, tag_ids, insert_missing_tags
+from pagination import encode_cursor
+from database.pool import TimedQueuePool, engine_options, pool_stats
+from database.replicas import replica_engines
+import auth.auth
+from auth.jwks import JWKSCache, parse_cache_control
+import compression
+import json_provider
+import warmup
+from json_provider import OrjsonProvider
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough RESP for the cache backend"""
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def write(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, Exception):
+            self.wfile.write(b"-%s\r\n" % str(value).encode())
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, list):
+            self.wfile.write(b"*%d\r\n" % len(value))
+            for item in value:
+                self.write(item)
+        elif value in ("OK", "QUEUED"):
+            self.wfile.write(b"+%s\r\n" % value.encode())
+        else:
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+
+    def handle(self):
+        queued = None
+        while True:
+            command = self.read_command()
+            if command is None:
+                return
+            name, args = command[0].upper(), command[1:]
+            if name == b"MULTI":
+                queued = []
+                self.write("OK")
+            elif name == b"EXEC":
+                with self.server.lock:
+                    self.write([self.run(*queued_command)
+                                for queued_command in queued])
+                queued = None
+            elif queued is not None:
+                queued.append((name, args))
+                self.write("QUEUED")
+            else:
+                with self.server.lock:
+                    self.write(self.run(name, args))
+
+    def run(self, name, args):
+        data = self.server.data
+        expires = self.server.expires
+        for key in [key for key, at in expires.items()
+                    if at < time.monotonic()]:
+            data.pop(key, None)
+            expires.pop(key)
+        if name == b"GET":
+            value = data.get(args[0])
+            return value if isinstance(value, bytes) else None
+        if name == b"SET":
+            data[args[0]] = args[1]
+            if len(args) > 3:
+                expires[args[0]] = time.monotonic() + int(args[3])
+            return "OK"
+        if name == b"SADD":
+            if isinstance(data.get(args[0]), bytes):
+                return Exception("WRONGTYPE Operation against a key holding "
+                                 "the wrong kind of value")
+            data.setdefault(args[0], set()).update(args[1:])
+            return len(args) - 1
+        if name == b"SMEMBERS":
+            return sorted(data.get(args[0], set()))
+        if name == b"EXPIRE":
+            expires[args[0]] = time.monotonic() + int(args[1])
+            return 1
+        if name == b"DEL":
+            return sum(data.pop(key, None) is not None for key in args)
+        if name == b"SCAN":
+            # everything in one step, cursor 0 ends the iteration
+            prefix = args[2].rstrip(b"*")
+            return [b"0", [key for key in data if key.startswith(prefix)]]
+        return "OK"
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return "redis://127.0.0.1:{}/0".format(self.server_address[1])
+
+
+class FakeJWKSHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the server's current JWKS document"""
+    def do_GET(self):
+        self.server.requests += 1
+        body = json.dumps({"keys": [
+            {"kid": kid, "kty": "RSA", "use": "sig", "n": "n", "e": "e"}
+            for kid in self.server.kids]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if self.server.cache_control:
+            self.send_header("Cache-Control", self.server.cache_control)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeJWKSServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, kids=("k1",), cache_control=None):
+        super().__init__(("127.0.0.1", 0), FakeJWKSHandler)
+        self.kids = list(kids)
+        self.cache_control = cache_control
+        self.requests = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/.well-known/jwks.json".format(
+            self.server_address[1])
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
 
 class CapstoneTestCase(unittest.TestCase):
     """This class represents the Capstone Project test case"""
@@ -40,7 +215,9 @@ class CapstoneTestCase(unittest.TestCase):
                 publisher_id=self.test_publisher_id,
                 author_id=self.test_author_id,
                 tags=",".join(self.test_article.get("tags")),
-                article_link=self.test_article.get("article_link")
+                # article_link is unique
+                article_link="{}/{}".format(
+                    self.test_article.get("article_link"), uuid.uuid4().hex)
             )
             
         new_article.insert()
@@ -53,6 +230,18 @@ class CapstoneTestCase(unittest.TestCase):
         
     def set_authorisation_header(self, token):
         self.headers.update({"Authorization":  f'Bearer {token}'})
+
+    def record_queries(self, fn):
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            result = fn()
+        finally:
+            event.remove(db.engine, "before_cursor_execute",
+                         before_cursor_execute)
+        return result, statements
         
     """Test Data"""
     #
@@ -259,6 +448,23 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data["message"]["description"], "Authorization header must be bearer token. Incorrect token format")
         self.assertEqual(data["message"]["code"], "invalid_header")
         
+    def test_get_author_details_fixed_query_count(self):
+        self.app.extensions.pop("response_cache")
+        for strategy in ["selectin", "joined"]:
+            self.app.config["RELATIONSHIP_LOAD_STRATEGY"] = strategy
+            url = "/authors/{}".format(self.test_author_id)
+            _, first = self.record_queries(lambda: self.client.get(url))
+            for _ in range(3):
+                self.create_test_article()
+            result, second = self.record_queries(lambda: self.client.get(url))
+            data = json.loads(result.data)
+
+            self.assertEqual(result.status_code, 200)
+            self.assertEqual(len(first), len(second))
+            self.assertEqual(len(data["author"]["articles"]),
+                             Article.query.filter(
+                                 Article.author_id == self.test_author_id).count())
+
     '''
     Tests for Publisher
     '''
@@ -272,6 +478,17 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertTrue(data["success"])
         self.assertTrue(len(data["publishers"]))
         
+    def test_get_publisher_details_loads_only_id_and_title(self):
+        url = "/publishers/{}".format(self.test_publisher_id)
+        result, statements = self.record_queries(lambda: self.client.get(url))
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(data["publisher"]["articles"][0]["article_id"],
+                         self.test_article_id)
+        self.assertFalse([statement for statement in statements
+                          if "articles.article_link" in statement])
+
     def test_get_publishers_404(self):
         result = self.client.get("/publishers?page=999")
         data = json.loads(result.data)
@@ -407,7 +624,245 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(result.status_code, 200)
         self.assertTrue(data["success"])
         self.assertTrue(len(data["articles"]))
-        
+
+    def test_get_paginated_articles_metadata(self):
+        result = self.client.get("/articles?per_page=1")
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(len(data["articles"]), 1)
+        self.assertEqual(data["page"], 1)
+        self.assertEqual(data["per_page"], 1)
+        self.assertEqual(data["total"], Article.query.count())
+        self.assertEqual(data["has_next"], data["total"] > 1)
+
+    def test_list_routes_match_format_short(self):
+        for route, model in [("articles", Article), ("authors", Author),
+                             ("publishers", Publisher)]:
+            data = json.loads(self.client.get(
+                "/{}?per_page=100".format(route)).data)
+            expected = [instance.format_short() for instance in
+                        model.query.order_by(model.id).limit(100).all()]
+
+            self.assertEqual(data[route], expected)
+
+    def test_get_articles_by_ids(self):
+        first_id = self.test_article_id
+        self.create_test_article()
+        url = "/articles?ids={},999999,{}".format(self.test_article_id, first_id)
+        result, statements = self.record_queries(lambda: self.client.get(url))
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([article["id"] for article in data["articles"]],
+                         [self.test_article_id, first_id])
+        self.assertEqual(data["missing"], [999999])
+        self.assertEqual(len(statements), 1)
+
+    def test_get_authors_by_ids(self):
+        result = self.client.get("/authors?ids={}".format(self.test_author_id))
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(data["authors"][0]["articles"][0]["article_id"],
+                         self.test_article_id)
+        self.assertEqual(data["missing"], [])
+
+    def test_get_articles_by_ids_invalid(self):
+        result = self.client.get("/articles?ids=1,abc")
+
+        self.assertEqual(result.status_code, 400)
+
+    def test_get_articles_cursor_walks_every_page(self):
+        self.create_test_article()
+        expected_ids = [article.id for article in
+                        Article.query.order_by(Article.id).all()]
+        seen_ids = []
+        url = "/articles?cursor=&per_page=1"
+        while url:
+            data = json.loads(self.client.get(url).data)
+            seen_ids += [article["id"] for article in data["articles"]]
+            url = None
+            if data["next_cursor"]:
+                url = "/articles?per_page=1&cursor={}".format(
+                    data["next_cursor"])
+
+        self.assertEqual(seen_ids, expected_ids)
+
+    def test_get_articles_after_id(self):
+        result = self.client.get(
+            "/articles?after_id={}".format(self.test_article_id - 1))
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(data["articles"][0]["id"], self.test_article_id)
+        self.assertNotIn("total", data)
+
+    def test_get_articles_invalid_cursor(self):
+        result = self.client.get("/articles?cursor=not-a-cursor")
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 400)
+        self.assertFalse(data["success"])
+
+    def test_get_articles_forged_cursor_and_page(self):
+        for keys in ([{}], [1, 2], [None], [[1]], [True]):
+            cursor = encode_cursor("id", keys)
+            result = self.client.get("/articles?cursor=" + cursor)
+            self.assertEqual(result.status_code, 400, keys)
+        for page in (0, -1):
+            result = self.client.get("/articles?page={}".format(page))
+            self.assertEqual(result.status_code, 400, page)
+
+    def test_get_articles_filtered_by_author(self):
+        result = self.client.get("/articles?per_page=100&author_id={}".format(
+            self.test_author_id))
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([article["id"] for article in data["articles"]],
+                         [self.test_article_id])
+        self.assertEqual(self.client.get(
+            "/articles?publisher_id=abc").status_code, 400)
+
+    def test_get_articles_sorted_by_title(self):
+        self.test_article = dict(self.test_article, title="AAA first")
+        self.create_test_article()
+        self.create_test_article()
+        expected = [article.id for article in Article.query.order_by(
+            Article.title.desc(), Article.id.desc()).all()]
+        seen_ids = []
+        url = "/articles?sort=-title&per_page=1&cursor="
+        while url:
+            data = json.loads(self.client.get(url).data)
+            seen_ids += [article["id"] for article in data["articles"]]
+            url = data["next_cursor"] and \
+                "/articles?sort=-title&per_page=1&cursor=" + data["next_cursor"]
+
+        self.assertEqual(seen_ids, expected)
+        data = json.loads(self.client.get("/articles?sort=title").data)
+        self.assertEqual(data["articles"][0]["title"], "AAA first")
+
+    def test_list_routes_reject_unsupported_sort(self):
+        for url in ("/articles?sort=tags", "/articles?sort=-names",
+                    "/authors?sort=name", "/publishers?sort=lastname",
+                    "/articles?sort=title&after_id=1"):
+            self.assertEqual(self.client.get(url).status_code, 400, url)
+
+    def test_get_authors_sorted_by_lastname(self):
+        data = json.loads(self.client.get(
+            "/authors?sort=lastname&per_page=100").data)
+        lastnames = [Author.query.get(author["id"]).lastname
+                     for author in data["authors"]]
+
+        self.assertEqual(lastnames, sorted(lastnames))
+
+    def test_get_article_details_sparse_fields(self):
+        url = "/articles/{}?fields=id,title,author_id".format(
+            self.test_article_id)
+        result, statements = self.record_queries(lambda: self.client.get(url))
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(data["article"], {
+            "id": self.test_article_id,
+            "title": self.test_article["title"],
+            "author_id": self.test_author_id})
+        # the other statement is the ETag version lookup
+        select = [s for s in statements if "articles.title" in s]
+        self.assertEqual(len(select), 1)
+        self.assertNotIn("article_link", select[0])
+        self.assertNotIn("tags", select[0])
+
+    def test_sparse_fields_rejects_unknown_fields(self):
+        for url in ("/articles?fields=id,version", "/articles/1?fields=",
+                    "/authors?fields=names", "/publishers/1?fields=title"):
+            self.assertEqual(self.client.get(url).status_code, 400, url)
+
+    def test_get_articles_sparse_fields_with_cursor(self):
+        self.create_test_article()
+        expected = [article.id for article in Article.query.order_by(
+            Article.title.desc(), Article.id.desc()).all()]
+        seen_ids = []
+        url = "/articles?fields=id&sort=-title&per_page=1&cursor="
+        while url:
+            data = json.loads(self.client.get(url).data)
+            self.assertEqual([list(article) for article in data["articles"]],
+                             [["id"]])
+            seen_ids += [article["id"] for article in data["articles"]]
+            url = data["next_cursor"] and "/articles?fields=id&sort=-title" \
+                "&per_page=1&cursor=" + data["next_cursor"]
+
+        self.assertEqual(seen_ids, expected)
+
+    def test_get_authors_sparse_fields_batches_articles(self):
+        self.create_test_author()
+        self.create_test_article()
+        url = "/authors?fields=full_name,articles&per_page=100"
+        result, statements = self.record_queries(lambda: self.client.get(url))
+        data = json.loads(result.data)
+        expected = {author.id: author.format() for author in Author.query}
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(len(statements), 3)
+        for author, (id, full) in zip(data["authors"], expected.items()):
+            self.assertEqual(author, {"full_name": full["full_name"],
+                                      "articles": full["articles"]})
+
+        result = self.client.get("/publishers?ids={},999999&fields=name".format(
+            self.test_publisher_id))
+        data = json.loads(result.data)
+        self.assertEqual(data["publishers"],
+                         [{"name": self.test_publisher["name"]}])
+        self.assertEqual(data["missing"], [999999])
+
+    def test_get_articles_include_batches_and_dedupes(self):
+        self.create_test_article()
+        self.create_test_article()
+        url = "/articles?include=author,publisher&per_page=100"
+        result, statements = self.record_queries(lambda: self.client.get(url))
+        data = json.loads(result.data)
+        author_ids = [author["id"] for author in data["included"]["authors"]]
+
+        self.assertEqual(result.status_code, 200)
+        # count, page, one IN query per included relation
+        self.assertEqual(len(statements), 4)
+        self.assertEqual(len(author_ids), len(set(author_ids)))
+        self.assertEqual(author_ids.count(self.test_author_id), 1)
+        self.assertIn({"id": self.test_publisher_id,
+                       "name": self.test_publisher["name"]},
+                      data["included"]["publishers"])
+        self.assertEqual(list(data["articles"][0]), ["id", "tags", "title"])
+
+    def test_get_article_details_include(self):
+        url = "/articles/{}?include=author&fields=title".format(
+            self.test_article_id)
+        data = json.loads(self.client.get(url).data)
+
+        self.assertEqual(data["article"],
+                         {"title": self.test_article["title"]})
+        self.assertEqual(data["included"], {"authors": [{
+            "id": self.test_author_id,
+            "full_name": "{}  {}".format(self.test_author["names"],
+                                         self.test_author["lastname"])}]})
+        self.assertEqual(self.client.get(
+            "/articles?include=tags").status_code, 400)
+        self.assertEqual(self.client.get(
+            "/articles?ids=1&include=").status_code, 400)
+
+    def test_article_include_follows_author_changes(self):
+        url = "/articles/{}?include=author".format(self.test_article_id)
+        etag = self.client.get(url).headers["ETag"]
+        author = Author.query.get(self.test_author_id)
+        author.lastname = "Renamed"
+        author.update()
+        result = self.client.get(url, headers={"If-None-Match": etag})
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertTrue(data["included"]["authors"][0]["full_name"]
+                        .endswith("Renamed"))
+
     def test_404_paginated_articles_OOB(self):
         result = self.client.get("/articles?page=9999")
         data = json.loads(result.data)
@@ -550,6 +1005,1055 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data["message"]["description"], "Authorization header must be bearer token. Incorrect token format")
         self.assertEqual(data["message"]["code"], "invalid_header")
     
+    '''
+    Tests for tags
+    '''
+
+    def article_tag_names(self, article_id):
+        return sorted(name for (name,) in db.session.query(Tag.name)
+                      .join(article_tags, article_tags.c.tag_id == Tag.id)
+                      .filter(article_tags.c.article_id == article_id))
+
+    def test_tags_are_normalized_on_write(self):
+        article = Article.query.get(self.test_article_id)
+
+        self.assertEqual(self.article_tag_names(self.test_article_id),
+                         sorted(self.test_article.get("tags")))
+        article.tags = "poem, Classic ,poem"
+        article.update()
+        self.assertEqual(self.article_tag_names(self.test_article_id),
+                         ["classic", "poem"])
+        self.assertEqual(article.tags, "poem, Classic ,poem")
+        article.delete()
+        self.assertEqual(self.article_tag_names(self.test_article_id), [])
+
+    def test_get_articles_by_tag(self):
+        first_id = self.test_article_id
+        self.test_article = dict(self.test_article, tags=["poem", "draft"])
+        self.create_test_article()
+        ids = lambda url: [article["id"] for article in json.loads(
+            self.client.get(url + "&per_page=100").data)["articles"]]
+
+        self.assertIn(first_id, ids("/articles?tag=poem&tag=popular"))
+        self.assertNotIn(self.test_article_id,
+                         ids("/articles?tag=poem&tag=popular"))
+        self.assertIn(self.test_article_id,
+                      ids("/articles?tag=popular&tag=draft&tag_mode=any"))
+        self.assertIn(first_id,
+                      ids("/articles?tag=popular&tag=draft&tag_mode=any"))
+        self.assertEqual(self.client.get(
+            "/articles?tag=poem&tag_mode=some").status_code, 400)
+
+    def test_bulk_create_links_tags(self):
+        item = dict(self.test_article, tags=["bulk-tag"],
+                    author_id=self.test_author_id,
+                    publisher_id=self.test_publisher_id)
+        with mock.patch.dict(os.environ, {"RUN_WITH_NO_AUTH": "true"}):
+            data = json.loads(self.client.post(
+                "/articles/bulk", headers=self.headers, json=[item]).data)
+
+        self.assertEqual(self.article_tag_names(data["created"][0]["id"]),
+                         ["bulk-tag"])
+
+    def tag_count(self, name):
+        tag = Tag.query.filter(Tag.name == name).one_or_none()
+        db.session.refresh(tag)
+        return tag.article_count
+
+    def test_tag_counts_follow_writes(self):
+        before = self.tag_count("poem")
+        self.create_test_article()
+        self.assertEqual(self.tag_count("poem"), before + 1)
+
+        article = Article.query.get(self.test_article_id)
+        article.tags = "popular"
+        article.update()
+        self.assertEqual(self.tag_count("poem"), before)
+
+        Author.query.get(self.test_author_id).delete()
+        self.assertEqual(self.tag_count("poem"), before - 1)
+
+    def test_get_tags(self):
+        result = self.client.get("/tags?per_page=100")
+        data = json.loads(result.data)
+        counts = [tag["count"] for tag in data["tags"]]
+
+        self.assertEqual(result.status_code, 200)
+        self.assertIn("poem", [tag["name"] for tag in data["tags"]])
+        self.assertEqual(counts, sorted(counts, reverse=True))
+
+    def test_get_tags_cursor(self):
+        names = []
+        url = "/tags?per_page=1&cursor="
+        while url:
+            data = json.loads(self.client.get(url).data)
+            names += [tag["name"] for tag in data["tags"]]
+            url = data["next_cursor"] and \
+                "/tags?per_page=1&cursor=" + data["next_cursor"]
+
+        self.assertEqual(names, [tag["name"] for tag in json.loads(
+            self.client.get("/tags?per_page=100").data)["tags"]])
+
+    def test_rebuild_tag_counts_command(self):
+        tag = Tag.query.filter(Tag.name == "poem").one()
+        expected = tag.article_count
+        tag.article_count = expected + 5
+        db.session.commit()
+        result = self.app.test_cli_runner().invoke(
+            args=["rebuild-tag-counts", "--relink"])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(self.tag_count("poem"), expected)
+
+    def test_concurrent_new_tag_does_not_conflict(self):
+        connection = db.session.connection()
+        existing = Tag.query.filter(Tag.name == "poem").one().id
+        # another writer inserted "poem" after this one looked it up
+        connection.execute(insert_missing_tags(connection),
+                           [{"name": "poem"}, {"name": "race-condition"}])
+        ids = tag_ids(connection, ["poem", "race-condition"])
+        db.session.rollback()
+
+        self.assertEqual(ids["poem"], existing)
+        self.assertIn("race-condition", ids)
+
+    def test_split_tags(self):
+        self.assertEqual(split_tags("Poem, top-rated,,poem "),
+                         ["poem", "top-rated"])
+
+    '''
+    Tests for search
+    '''
+
+    def search_ids(self, q):
+        result = self.client.get("/articles/search?per_page=100&q=" + q)
+        self.assertEqual(result.status_code, 200)
+        return [article["id"] for article in json.loads(result.data)["articles"]]
+
+    def test_search_articles_ranks_title_matches_first(self):
+        word = "quokka{}".format(self.test_article_id)
+        self.test_article = dict(self.test_article, title="Notes",
+                                 tags=[word])
+        self.create_test_article()
+        tag_match = self.test_article_id
+        self.test_article = dict(self.test_article,
+                                 title=f"The {word} Papers", tags=["poem"])
+        self.create_test_article()
+        title_match = self.test_article_id
+
+        self.assertEqual(self.search_ids(word), [title_match, tag_match])
+        self.assertEqual(self.search_ids(word + " papers"), [title_match])
+        self.assertEqual(self.search_ids(word[:-1]), [title_match, tag_match])
+
+    def test_search_follows_article_writes(self):
+        word = "wombat{}".format(self.test_article_id)
+        article = Article.query.get(self.test_article_id)
+        self.assertEqual(self.search_ids(word), [])
+
+        article.title = f"About {word}"
+        article.update()
+        self.assertEqual(self.search_ids(word), [self.test_article_id])
+        article.delete()
+        self.assertEqual(self.search_ids(word), [])
+
+    def test_search_requires_query(self):
+        self.assertEqual(
+            self.client.get("/articles/search?q=").status_code, 400)
+        self.assertEqual(
+            self.client.get("/articles/search?q=%20-").status_code, 400)
+
+    '''
+    Tests for bulk writes
+    '''
+
+    def test_bulk_create_articles(self):
+        link = self.test_article.get("article_link")
+        items = [dict(self.test_article, author_id=self.test_author_id,
+                      publisher_id=self.test_publisher_id,
+                      article_link=f"{link}/bulk-{n}") for n in range(3)]
+        items.insert(1, dict(items[0], title=""))
+        items.append(dict(items[0], article_link=f"{link}/bulk-4",
+                          author_id=999999))
+        items.append(items[0])
+        items.append(dict(items[0], article_link=Article.query.get(
+            self.test_article_id).article_link))
+        with mock.patch.dict(os.environ, {"RUN_WITH_NO_AUTH": "true"}):
+            result = self.client.post("/articles/bulk", headers=self.headers,
+                                      json=items)
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(data["total_created"], 3)
+        self.assertEqual([item["index"] for item in data["created"]], [0, 2, 3])
+        self.assertEqual(data["errors"][:2], [
+            {"index": 1, "message": "title is required"},
+            {"index": 4, "message": "author_id 999999 does not exist"}])
+        self.assertEqual([error["index"] for error in data["errors"][2:]],
+                         [5, 6])
+        self.assertTrue(all(error["message"].endswith("already exists")
+                            for error in data["errors"][2:]))
+        self.assertIn("rows_per_second", data)
+        for item in data["created"]:
+            self.assertEqual(Article.query.get(item["id"]).title,
+                             self.test_article.get("title"))
+
+    def test_bulk_upsert_articles(self):
+        link = self.test_article.get("article_link")
+        new_item = dict(self.test_article, article_link=link + "/new",
+                        author_id=self.test_author_id,
+                        publisher_id=self.test_publisher_id)
+        items = [
+            {"id": self.test_article_id, "tags": ["poem"]},
+            {"id": self.test_article_id + 1000000, "tags": ["poem"]},
+            new_item,
+            {"article_link": link + "/incomplete"},
+        ]
+        with mock.patch.dict(os.environ, {"RUN_WITH_NO_AUTH": "true"}):
+            result = self.client.patch("/articles/bulk", headers=self.headers,
+                                       json=items)
+            data = json.loads(result.data)
+            again = json.loads(self.client.patch(
+                "/articles/bulk", headers=self.headers, json=items[:1]).data)
+        article = Article.query.get(self.test_article_id)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual((data["created"], data["updated"], data["unchanged"]),
+                         (1, 1, 0))
+        self.assertEqual([error["index"] for error in data["errors"]], [1, 3])
+        self.assertEqual(article.tags, "poem")
+        self.assertEqual(article.title, self.test_article.get("title"))
+        self.assertEqual(article.version, 2)
+        self.assertEqual(Article.query.filter(
+            Article.article_link == link + "/new").count(), 1)
+        self.assertEqual((again["updated"], again["unchanged"]), (0, 1))
+
+    def test_bulk_upsert_conflicting_insert_updates(self):
+        # the key was inserted by another writer after bulk_upsert read it
+        link = Article.query.get(self.test_article_id).article_link
+        ids = upsert_rows(Article, [dict(
+            title=self.test_article.get("title"), article_link=link,
+            tags="poem", author_id=self.test_author_id,
+            publisher_id=self.test_publisher_id)])
+        db.session.commit()
+        db.session.expire_all()
+        article = Article.query.get(self.test_article_id)
+
+        self.assertEqual(ids, [self.test_article_id])
+        self.assertEqual((article.tags, article.version), ("poem", 2))
+        self.assertEqual(Article.query.filter(
+            Article.article_link == link).count(), 1)
+
+    def test_bulk_create_authors(self):
+        with mock.patch.dict(os.environ, {"RUN_WITH_NO_AUTH": "true"}):
+            result = self.client.post("/authors/bulk", headers=self.headers,
+                                      json=[self.test_author, self.test_author])
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(data["total_created"], 2)
+        self.assertEqual(data["errors"], [])
+
+    def test_bulk_create_requires_list(self):
+        with mock.patch.dict(os.environ, {"RUN_WITH_NO_AUTH": "true"}):
+            result = self.client.post("/publishers/bulk", headers=self.headers,
+                                      json=self.test_publisher)
+
+        self.assertEqual(result.status_code, 422)
+
+    def test_bulk_create_no_auth_token(self):
+        self.set_authorisation_header("")
+        result = self.client.post("/articles/bulk", headers=self.headers,
+                                  json=[self.test_article])
+
+        self.assertEqual(result.status_code, 401)
+
+    '''
+    Query counts of the write routes
+        the response is built from the committed objects in memory, nothing
+        is read back after the INSERT / UPDATE
+    '''
+
+    def write_statements(self, method, url, body):
+        # a request starts with an empty session
+        db.session.expunge_all()
+        with mock.patch.dict(os.environ, {"RUN_WITH_NO_AUTH": "true"}):
+            result, statements = self.record_queries(
+                lambda: getattr(self.client, method)(
+                    url, headers=self.headers, json=body))
+        self.assertEqual(result.status_code, 200, url)
+        return json.loads(result.data), statements
+
+    def reads(self, statements, table):
+        return [statement for statement in statements
+                if statement.lstrip().startswith("SELECT")
+                and f"FROM {table}" in statement]
+
+    def test_post_author_query_count(self):
+        data, statements = self.write_statements(
+            "post", "/authors", self.test_author)
+
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(data["author"]["articles"], [])
+        self.assertEqual(Author.query.get(data["author"]["id"]).names,
+                         self.test_author["names"])
+
+    def test_post_publisher_query_count(self):
+        data, statements = self.write_statements(
+            "post", "/publishers", self.test_publisher)
+
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(data["publisher"]["name"], self.test_publisher["name"])
+
+    def test_post_article_query_count(self):
+        body = dict(self.test_article, author_id=self.test_author_id,
+                    publisher_id=self.test_publisher_id)
+        data, statements = self.write_statements("post", "/articles", body)
+
+        self.assertEqual(self.reads(statements, "articles"), [])
+        self.assertEqual(len([statement for statement in statements
+                              if "INTO articles" in statement]), 1)
+        self.assertEqual(data["article"]["author_id"], self.test_author_id)
+
+    def test_patch_article_query_count(self):
+        body = dict(self.test_article, title="Patched title",
+                    author_id=self.test_author_id,
+                    publisher_id=self.test_publisher_id)
+        data, statements = self.write_statements(
+            "patch", "/articles/{}".format(self.test_article_id), body)
+
+        # only the lookup of the article to update
+        self.assertEqual(len(self.reads(statements, "articles")), 1)
+        self.assertEqual(data["article"]["title"], "Patched title")
+        self.assertEqual(Article.query.get(self.test_article_id).title,
+                         "Patched title")
+
+    def test_patch_author_query_count(self):
+        data, statements = self.write_statements(
+            "patch", "/authors/{}".format(self.test_author_id),
+            {"names": "Patched", "lastname": "Author"})
+
+        # lookup, UPDATE, the articles embedded in the response
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(len(self.reads(statements, "authors")), 1)
+        self.assertEqual(data["author"]["full_name"], "Patched  Author")
+        self.assertEqual(data["author"]["articles"][0]["article_id"],
+                         self.test_article_id)
+
+    def test_patch_publisher_query_count(self):
+        data, statements = self.write_statements(
+            "patch", "/publishers/{}".format(self.test_publisher_id),
+            {"name": "Patched", "company_link": "www.patched.com"})
+
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(len(self.reads(statements, "publishers")), 1)
+        self.assertEqual(data["publisher"]["name"], "Patched")
+
+    def test_bulk_routes_query_count(self):
+        article = dict(self.test_article, author_id=self.test_author_id,
+                       publisher_id=self.test_publisher_id,
+                       article_link="www.bulk-query-count.com")
+        # both article routes look up the natural keys once, PATCH to
+        # diff the existing rows and POST to reject the taken ones
+        for method, url, body, table, lookups in [
+                ("post", "/authors/bulk", self.test_author, "authors", 0),
+                ("post", "/publishers/bulk", self.test_publisher,
+                 "publishers", 0),
+                ("post", "/articles/bulk", article, "articles", 1),
+                ("patch", "/articles/bulk", article, "articles", 1)]:
+            _, statements = self.write_statements(method, url, [body])
+            self.assertEqual(len(self.reads(statements, table)), lookups, url)
+
+    '''
+    Tests for conditional GET
+    '''
+
+    def test_article_details_not_modified(self):
+        url = "/articles/{}".format(self.test_article_id)
+        first = self.client.get(url)
+        etag = first.headers["ETag"]
+        # answered from the response cache
+        result, statements = self.record_queries(lambda: self.client.get(
+            url, headers={"If-None-Match": etag}))
+
+        self.assertEqual(result.status_code, 304)
+        self.assertEqual(result.data, b"")
+        self.assertEqual(result.headers["ETag"], etag)
+        self.assertEqual(statements, [])
+
+        # without the cache only the row versions are read
+        get_cache().disabled_routes.add("get_article_details")
+        result, statements = self.record_queries(lambda: self.client.get(
+            url, headers={"If-None-Match": etag}))
+
+        self.assertEqual(result.status_code, 304)
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("article_link", statements[0])
+
+    def test_not_modified_responses_vary_on_encoding(self):
+        urls = ["/publishers", "/articles/{}".format(self.test_article_id)]
+        for cached in (True, False):
+            if not cached:
+                get_cache().disabled_routes.update(
+                    ["get_publishers", "get_article_details"])
+            for url in urls:
+                etag = self.client.get(url).headers["ETag"]
+                result = self.client.get(url, headers={"If-None-Match": etag})
+
+                self.assertEqual(result.status_code, 304, url)
+                self.assertIn("Accept-Encoding", result.headers["Vary"], url)
+
+    def test_article_etag_changes_on_update(self):
+        url = "/articles/{}".format(self.test_article_id)
+        etag = self.client.get(url).headers["ETag"]
+        article = Article.query.get(self.test_article_id)
+        version = article.version
+        article.article_link = "www.test-link-to-article.com/v2"
+        article.update()
+        result = self.client.get(url, headers={"If-None-Match": etag})
+
+        self.assertEqual(article.version, version + 1)
+        self.assertEqual(result.status_code, 200)
+        self.assertNotEqual(result.headers["ETag"], etag)
+
+    def test_author_etag_follows_article_changes(self):
+        url = "/authors/{}".format(self.test_author_id)
+        etag = self.client.get(url).headers["ETag"]
+        self.create_test_article()
+        result = self.client.get(url, headers={"If-None-Match": etag})
+
+        self.assertEqual(result.status_code, 200)
+        self.assertNotEqual(result.headers["ETag"], etag)
+
+    def test_list_not_modified(self):
+        etag = self.client.get("/publishers").headers["ETag"]
+        result = self.client.get("/publishers",
+                                 headers={"If-None-Match": etag})
+
+        self.assertEqual(result.status_code, 304)
+
+    '''
+    Tests for the response cache
+    '''
+
+    def test_cache_serves_repeat_requests(self):
+        url = "/articles/{}".format(self.test_article_id)
+        first = self.client.get(url)
+        second, statements = self.record_queries(lambda: self.client.get(url))
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(statements, [])
+        self.assertEqual(get_cache().stats()["hits"], 1)
+
+    def test_cache_invalidates_parent_on_article_update(self):
+        url = "/authors/{}".format(self.test_author_id)
+        self.client.get(url)
+        article = Article.query.get(self.test_article_id)
+        article.title = "Test Article Title"[::-1]
+        article.update()
+        data = json.loads(self.client.get(url).data)
+        article.title = self.test_article.get("title")
+        article.update()
+
+        self.assertEqual(data["author"]["articles"][0]["title"],
+                         "Test Article Title"[::-1])
+        self.assertEqual(get_cache().stats()["hits"], 0)
+
+    def test_cache_keeps_article_lists_on_author_update(self):
+        self.client.get("/articles?per_page=100")
+        author = Author.query.get(self.test_author_id)
+        author.names = "Renamed"
+        author.update()
+        self.client.get("/articles?per_page=100")
+
+        self.assertEqual(get_cache().stats()["hits"], 1)
+
+    def test_cache_invalidates_article_lists_on_author_delete(self):
+        author_id, article_id = self.test_author_id, self.test_article_id
+        # keeps the lists non empty once the first author is gone
+        self.create_test_author()
+        self.create_test_article()
+        self.client.get("/articles?per_page=100")
+        self.client.get("/tags?per_page=100")
+        Author.query.get(author_id).delete()
+        articles = json.loads(self.client.get("/articles?per_page=100").data)
+        self.client.get("/tags?per_page=100")
+
+        self.assertNotIn(article_id,
+                         [article["id"] for article in articles["articles"]])
+        self.assertEqual(get_cache().stats()["hits"], 0)
+
+    def test_cache_invalidates_list_on_insert(self):
+        self.client.get("/articles?per_page=100")
+        self.create_test_article()
+        data = json.loads(self.client.get("/articles?per_page=100").data)
+
+        self.assertIn(self.test_article_id,
+                      [article["id"] for article in data["articles"]])
+
+    def test_cache_route_switch(self):
+        get_cache().disabled_routes.add("get_articles")
+        self.client.get("/articles")
+        self.client.get("/articles")
+
+        self.assertEqual(get_cache().stats()["hits"], 0)
+
+    def test_cache_lru_eviction_and_ttl(self):
+        cache = ResponseCache(MemoryBackend(max_entries=2), ttl=60)
+        cache.set("a", b"a", ["articles:1"])
+        cache.set("b", b"b", ["articles:2"])
+        cache.get("a")
+        cache.set("c", b"c", ["articles:3"])
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"a")
+        self.assertEqual(cache.stats()["evictions"], 1)
+        cache.invalidate(["articles:1"])
+        self.assertIsNone(cache.get("a"))
+        cache.ttl = -1
+        cache.set("d", b"d", [])
+        self.assertIsNone(cache.get("d"))
+
+    def test_redis_backend_tags_and_invalidation(self):
+        server = FakeRedisServer()
+        backend = RedisBackend(server.url)
+        backend.set("/articles/1", b"one", ["articles:1", "articles:list"], 60)
+        backend.set("/articles", b"list", ["articles:list"], 60)
+
+        self.assertEqual(backend.get("/articles/1"), b"one")
+        backend.invalidate(["articles:list"])
+        self.assertIsNone(backend.get("/articles/1"))
+        self.assertIsNone(backend.get("/articles"))
+        self.assertNotIn(b"rc:tag:articles:list", server.data)
+        backend.set("/articles", b"list", ["articles:list"], 60)
+        backend.invalidate(["articles:list"])
+        self.assertIsNone(backend.get("/articles"))
+        self.assertEqual(backend.stats()["errors"], 0)
+
+        backend.set("/articles/2", b"two", ["articles:2"], 60)
+        backend.clear()
+        self.assertEqual(server.data, {})
+        # a command failing inside MULTI/EXEC counts as an error
+        server.data[b"rc:tag:articles:3"] = b"not a set"
+        backend.set("/articles/3", b"three", ["articles:3"], 60)
+        self.assertEqual(backend.stats()["errors"], 1)
+        server.shutdown()
+        server.server_close()
+
+    def test_redis_backend_down_is_a_miss(self):
+        server = FakeRedisServer()
+        url = server.url
+        server.shutdown()
+        server.server_close()
+        backend = RedisBackend(url)
+
+        self.assertIsNone(backend.get("/articles"))
+        backend.set("/articles", b"list", ["articles:list"], 60)
+        self.assertEqual(backend.stats()["errors"], 2)
+
+    def test_shared_cache_invalidation_reaches_other_workers(self):
+        server = FakeRedisServer()
+        worker_apps = []
+        for _ in range(2):
+            worker = create_app()
+            setup_db(worker, self.database_path)
+            worker.config["RESPONSE_CACHE_URL"] = server.url
+            worker.extensions["response_cache"] = ResponseCache(
+                RedisBackend(server.url))
+            worker_apps.append(worker)
+        reader, writer = worker_apps
+        url = "/articles/{}".format(self.test_article_id)
+
+        with reader.app_context():
+            reader.test_client().get(url)
+            reader.test_client().get(url)
+            self.assertEqual(reader.extensions["response_cache"].hits, 1)
+        with writer.app_context():
+            article = Article.query.get(self.test_article_id)
+            article.article_link = "www.test-link-to-article.com/v2"
+            article.update()
+        with reader.app_context():
+            data = json.loads(reader.test_client().get(url).data)
+            self.assertEqual(data["article"]["article_link"],
+                             "www.test-link-to-article.com/v2")
+            db.session.remove()
+        server.shutdown()
+        server.server_close()
+
+    def test_get_metrics(self):
+        result = self.client.get("/metrics")
+        data = json.loads(result.data)
+
+        self.assertEqual(result.status_code, 200)
+        self.assertIn("hits", data["cache"])
+        self.assertIn("class", data["pool"])
+
+    '''
+    Tests for startup
+    '''
+
+    STARTUP_SCRIPT = """
+import gc, json, time
+start = time.perf_counter()
+from app import app
+from flask import Flask
+status = app.test_client().get("/checkifworking").status_code
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "status": status,
+    "apps": sum(type(o) is Flask for o in gc.get_objects()),
+    "warmup": app.extensions["warmup"].stats(),
+}))
+"""
+
+    def run_startup(self, **env):
+        result = subprocess.run(
+            [sys.executable, "-c", self.STARTUP_SCRIPT],
+            cwd=path.dirname(path.abspath(__file__)),
+            env=dict(os.environ, **env), capture_output=True, text=True,
+            timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def test_startup_time(self):
+        # import of app.py with warm-up plus the first request, in a fresh
+        # interpreter
+        budget = float(os.environ.get("STARTUP_BUDGET_SECONDS", 5))
+        startup = self.run_startup(WARMUP="sync")
+
+        self.assertEqual(startup["status"], 200)
+        self.assertEqual(startup["apps"], 1)
+        self.assertLess(startup["seconds"], budget)
+
+    def test_startup_without_create_all(self):
+        db_file = path.join(tempfile.mkdtemp(), "empty.db")
+        startup = self.run_startup(WARMUP="sync", DB_CREATE_ALL="false",
+                                   DATABASE_URI="sqlite:///" + db_file)
+
+        self.assertFalse(path.exists(db_file) and path.getsize(db_file))
+        # no route GETs against the missing tables
+        self.assertEqual(startup["warmup"]["skipped"], ["routes"])
+        self.assertEqual(startup["warmup"]["errors"], [])
+
+    '''
+    Tests for warm-up
+    '''
+
+    def test_warm_up_on_create_app(self):
+        server = FakeJWKSServer()
+        auth.auth.jwks_cache.clear()
+        with mock.patch.dict(os.environ, {"WARMUP": "sync"}), \
+                mock.patch("warmup.AUTH0_DOMAIN", "example.auth0.com"), \
+                mock.patch.object(auth.auth.jwks_cache, "url", server.url):
+            app = create_app()
+            self.assertEqual(auth.auth.get_jwks()["keys"][0]["kid"], "k1")
+        auth.auth.jwks_cache.clear()
+        server.close()
+        state = app.extensions["warmup"]
+
+        self.assertEqual(list(state.steps),
+                         ["mappers", "pool", "signing_keys", "schema",
+                          "routes"])
+        self.assertEqual(state.errors, [])
+        self.assertEqual(server.requests, 1)
+        self.assertEqual(app.extensions["response_cache"].stats()["misses"], 0)
+        self.assertEqual(app.test_client().get("/ready").status_code, 200)
+
+    def test_sync_warm_up_disposes_pools(self):
+        # gunicorn --preload forks after create_app, the workers must not
+        # inherit the warm-up connections
+        with mock.patch.dict(os.environ, {"WARMUP": "sync"}), \
+                mock.patch.object(Engine, "dispose", autospec=True) as dispose:
+            app = create_app()
+
+        with app.app_context():
+            self.assertEqual([call.args[0] for call in dispose.call_args_list],
+                             [db.engine])
+
+    def test_warm_up_keeps_the_response_cache_attached(self):
+        app = create_app()
+        attached = []
+        app.before_request(
+            lambda: attached.append("response_cache" in app.extensions))
+        warmup.warm_up_routes(app)
+        cache = app.extensions["response_cache"]
+
+        # live requests during a background warm-up still see the cache,
+        # so their writes keep invalidating it
+        self.assertTrue(attached)
+        self.assertTrue(all(attached))
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+        self.assertEqual(cache.backend.stats()["entries"], 0)
+
+    def test_unknown_kid_does_not_refetch_jwks_every_request(self):
+        server = FakeJWKSServer(cache_control="max-age=600")
+        token = jwt.encode({"sub": "x"}, "secret", algorithm="HS256",
+                           headers={"kid": "unknown"})
+        with mock.patch.object(auth.auth, "jwks_cache", JWKSCache(
+                server.url, min_refresh_interval=30)):
+            for _ in range(5):
+                with self.assertRaises(auth.auth.AuthError):
+                    auth.auth.verify_decode_jwt(token)
+        server.close()
+
+        self.assertEqual(server.requests, 1)
+
+    def test_not_ready_until_background_warm_up_finishes(self):
+        release = threading.Event()
+        with mock.patch.dict(os.environ, {"WARMUP": "background"}), \
+                mock.patch("warmup.prime_pools",
+                           side_effect=lambda app: release.wait(5)):
+            app = create_app()
+            client = app.test_client()
+            result = client.get("/ready")
+            self.assertEqual(result.status_code, 503)
+            self.assertFalse(json.loads(result.data)["ready"])
+            release.set()
+            for _ in range(100):
+                if app.extensions["warmup"].ready:
+                    break
+                time.sleep(0.05)
+
+        self.assertEqual(client.get("/ready").status_code, 200)
+
+    '''
+    Tests for the JWKS cache
+    '''
+
+    def test_parse_cache_control(self):
+        self.assertEqual(parse_cache_control(
+            "public, max-age=600, stale-while-revalidate=30"), (600, 30))
+        self.assertEqual(parse_cache_control("no-store"), (0, None))
+        self.assertEqual(parse_cache_control(None), (None, None))
+
+    def test_jwks_cached_for_max_age(self):
+        server = FakeJWKSServer(cache_control="max-age=60")
+        clock = FakeClock()
+        jwks = JWKSCache(server.url, default_ttl=5, clock=clock)
+
+        jwks.get()
+        clock.now += 59
+        jwks.get()
+        self.assertEqual(server.requests, 1)
+        clock.now += 2
+        jwks.get()
+        self.assertEqual(server.requests, 2)
+        server.close()
+
+    def test_jwks_refresh_on_unknown_kid_is_rate_limited(self):
+        server = FakeJWKSServer(cache_control="max-age=600")
+        clock = FakeClock()
+        jwks = JWKSCache(server.url, min_refresh_interval=30, clock=clock)
+        jwks.get()
+        server.kids = ["k2"]
+
+        clock.now += 31
+        self.assertEqual(auth.auth.find_rsa_key(jwks.refresh(), "k2")["kid"],
+                         "k2")
+        jwks.refresh()
+        jwks.refresh()
+        self.assertEqual(server.requests, 2)
+        server.close()
+
+    def test_jwks_stale_while_revalidate(self):
+        server = FakeJWKSServer(
+            cache_control="max-age=60, stale-while-revalidate=120")
+        clock = FakeClock()
+        jwks = JWKSCache(server.url, clock=clock)
+        jwks.get()
+        server.kids = ["k2"]
+
+        clock.now += 90
+        self.assertEqual(jwks.get()["keys"][0]["kid"], "k1")
+        for _ in range(100):
+            if jwks.fetches == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(jwks.get()["keys"][0]["kid"], "k2")
+        self.assertEqual(server.requests, 2)
+        server.close()
+
+    def test_jwks_serves_stale_keys_when_auth0_is_down(self):
+        server = FakeJWKSServer(cache_control="max-age=60")
+        clock = FakeClock()
+        jwks = JWKSCache(server.url, clock=clock, timeout=0.5)
+        jwks.get()
+        server.close()
+
+        clock.now += 600
+        self.assertEqual(jwks.get()["keys"][0]["kid"], "k1")
+        self.assertEqual(jwks.get()["keys"][0]["kid"], "k1")
+        self.assertEqual(jwks.stats()["errors"], 1)
+
+    '''
+    Tests for the verified token cache
+    '''
+
+    def patch_with_token(self, token, payload, article_id=999999):
+        self.set_authorisation_header(token)
+        with mock.patch("auth.auth.verify_decode_jwt",
+                        return_value=payload) as verify:
+            result = self.client.patch("/articles/{}".format(article_id),
+                                       headers=self.headers, json={})
+        return result, verify.call_count
+
+    def test_repeat_token_skips_verification(self):
+        auth.auth.token_cache.clear()
+        payload = {"exp": time.time() + 3600,
+                   "permissions": ["patch:articles"]}
+
+        first, first_calls = self.patch_with_token("a.b.c", payload)
+        second, second_calls = self.patch_with_token("a.b.c", payload)
+        stats = json.loads(self.client.get("/metrics").data)["tokens"]
+
+        self.assertEqual((first.status_code, first_calls), (404, 1))
+        self.assertEqual((second.status_code, second_calls), (404, 0))
+        self.assertGreaterEqual(stats["hits"], 1)
+        self.assertIsNotNone(stats["verify_ms_avg"])
+
+    def test_cached_token_permissions_still_checked(self):
+        auth.auth.token_cache.clear()
+        payload = {"exp": time.time() + 3600,
+                   "permissions": ["delete:articles"]}
+
+        self.patch_with_token("d.e.f", payload)
+        result, calls = self.patch_with_token("d.e.f", payload)
+
+        self.assertEqual((result.status_code, calls), (403, 0))
+
+    def test_expired_or_exp_less_tokens_are_not_cached(self):
+        auth.auth.token_cache.clear()
+        for payload in ({"exp": time.time() - 1,
+                         "permissions": ["patch:articles"]},
+                        {"permissions": ["patch:articles"]}):
+            self.patch_with_token("g.h.i", payload)
+            _, calls = self.patch_with_token("g.h.i", payload)
+            self.assertEqual(calls, 1)
+
+    '''
+    Tests for the JSON provider
+    '''
+
+    @unittest.skipIf(json_provider.orjson is None, "orjson not installed")
+    def test_orjson_responses_match_stdlib(self):
+        fast = create_app()
+        with mock.patch.dict(os.environ, {"JSON_PROVIDER": "stdlib"}):
+            slow = create_app()
+        for app in (fast, slow):
+            setup_db(app, self.database_path)
+            app.extensions.pop("response_cache", None)
+
+        self.assertIsInstance(fast.json, OrjsonProvider)
+        self.assertNotIsInstance(slow.json, OrjsonProvider)
+        for url in ("/articles", "/authors", "/publishers", "/tags",
+                    "/articles/{}".format(self.test_article_id),
+                    "/authors/{}".format(self.test_author_id),
+                    "/publishers/{}".format(self.test_publisher_id)):
+            result = fast.test_client().get(url)
+            self.assertEqual(result.status_code, 200, url)
+            self.assertEqual(result.data,
+                             slow.test_client().get(url).data, url)
+
+    @unittest.skipIf(json_provider.orjson is None, "orjson not installed")
+    def test_orjson_falls_back_to_stdlib(self):
+        provider = OrjsonProvider(self.app)
+
+        self.assertEqual(provider.dumps({"n": 2 ** 70, "b": 1},
+                                        separators=(",", ":")),
+                         '{"b":1,"n":1180591620717411303424}')
+        self.assertEqual(provider.dumps({2: "b", 1: "a"},
+                                        separators=(",", ":")),
+                         '{"1":"a","2":"b"}')
+
+    '''
+    Tests for compression
+    '''
+
+    def test_gzip_negotiated_over_threshold(self):
+        self.app.config["COMPRESSION_MIN_SIZE"] = 0
+        url = "/authors/{}".format(self.test_author_id)
+        plain = self.client.get(url)
+        result = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(result.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", result.headers["Vary"])
+        self.assertEqual(gzip.decompress(result.data), plain.data)
+        self.assertTrue(result.headers["ETag"].startswith('W/'))
+        not_modified = self.client.get(url, headers={
+            "Accept-Encoding": "gzip",
+            "If-None-Match": result.headers["ETag"]})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_list_etag_stable_across_compressed_cache_hits(self):
+        self.app.config["COMPRESSION_MIN_SIZE"] = 0
+        headers = {"Accept-Encoding": "gzip"}
+        for url in ("/articles", "/tags",
+                    "/articles/search?q=" + self.test_article["tags"][0]):
+            first = self.client.get(url, headers=headers)
+            second = self.client.get(url, headers=headers)
+            plain = self.client.get(url)
+            not_modified = self.client.get(url, headers={
+                **headers, "If-None-Match": first.headers["ETag"]})
+
+            self.assertEqual(second.headers["Content-Encoding"], "gzip", url)
+            # the ETag stands for the plain body in every encoding
+            self.assertEqual(first.headers["ETag"], second.headers["ETag"])
+            self.assertEqual(first.headers["ETag"],
+                             "W/" + plain.headers["ETag"])
+            self.assertEqual(not_modified.status_code, 304, url)
+            self.assertEqual(not_modified.headers["ETag"],
+                             first.headers["ETag"])
+
+    def test_small_responses_not_compressed(self):
+        self.app.config["COMPRESSION_MIN_SIZE"] = 10 ** 6
+        result = self.client.get("/articles",
+                                 headers={"Accept-Encoding": "gzip"})
+
+        self.assertNotIn("Content-Encoding", result.headers)
+        self.assertEqual(json.loads(result.data)["success"], True)
+
+    def test_compressed_bytes_are_cached(self):
+        self.app.config["COMPRESSION_MIN_SIZE"] = 0
+        headers = {"Accept-Encoding": "gzip"}
+        url = "/publishers/{}".format(self.test_publisher_id)
+        with mock.patch("compression.compress",
+                        wraps=compression.compress) as compress:
+            first = self.client.get(url, headers=headers)
+            second = self.client.get(url, headers=headers)
+
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(second.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(second.data),
+                         gzip.decompress(first.data))
+
+        publisher = Publisher.query.get(self.test_publisher_id)
+        publisher.name = "Renamed Company"
+        publisher.update()
+        third = self.client.get(url, headers=headers)
+        self.assertIn(b"Renamed Company", gzip.decompress(third.data))
+
+    '''
+    Tests for the connection pool
+    '''
+
+    def test_engine_options_from_env(self):
+        env = {"DB_POOL_SIZE": "3", "DB_MAX_OVERFLOW": "0",
+               "DB_POOL_PRE_PING": "false", "DB_STATEMENT_TIMEOUT_MS": "5000",
+               "DB_APPLICATION_NAME": "capstone-worker"}
+        with mock.patch.dict(os.environ, env):
+            options = engine_options("postgresql://u:p@localhost:5432/db")
+            sqlite_options = engine_options("sqlite:////tmp/db.sqlite")
+
+        self.assertEqual(options["pool_size"], 3)
+        self.assertEqual(options["max_overflow"], 0)
+        self.assertFalse(options["pool_pre_ping"])
+        self.assertIs(options["poolclass"], TimedQueuePool)
+        self.assertEqual(options["connect_args"], {
+            "application_name": "capstone-worker",
+            "options": "-c statement_timeout=5000"})
+        self.assertNotIn("pool_size", sqlite_options)
+
+    def test_pool_records_checkout_wait(self):
+        engine = create_engine("sqlite://", poolclass=TimedQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+        connection = engine.connect()
+        self.assertEqual(pool_stats(engine)["checked_out"], 1)
+        with self.assertRaises(Exception):
+            engine.connect()
+        connection.close()
+        stats = pool_stats(engine)
+
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertGreaterEqual(stats["wait_ms_max"], 50)
+
+    '''
+    Tests for read replicas
+    '''
+
+    def create_replica_app(self, count=1, cache=False):
+        replica_uris = ["sqlite:///" + path.join(tempfile.mkdtemp(), "replica.db")
+                        for _ in range(count)]
+        app = create_app()
+        if not cache:
+            app.extensions.pop("response_cache", None)
+        setup_db(app, self.database_path, replica_uris=replica_uris)
+        with app.app_context():
+            # the replicas start empty, rows on the primary are not there
+            for engine in replica_engines(db.engines):
+                db.metadata.create_all(bind=engine)
+        return app
+
+    def test_reads_use_replica_until_client_writes(self):
+        app = self.create_replica_app()
+        client = app.test_client()
+        url = "/authors/{}".format(self.test_author_id)
+
+        self.assertEqual(client.get(url).status_code, 404)
+        with mock.patch.dict(os.environ, {"RUN_WITH_NO_AUTH": "true"}):
+            result = client.post("/authors", headers=self.headers,
+                                 json=self.test_author)
+        new_id = json.loads(result.data)["author"]["id"]
+        self.assertIsNotNone(Author.query.get(new_id))
+        self.assertEqual(client.get(url).status_code, 200)
+
+        client.cookie_jar.clear()
+        self.assertEqual(client.get(url).status_code, 404)
+
+    def test_preflight_does_not_pin_to_primary(self):
+        app = self.create_replica_app()
+        client = app.test_client()
+        result = client.options("/authors", headers={
+            "Origin": "http://localhost:3000",
+            "Access-Control-Request-Method": "POST"})
+
+        self.assertLess(result.status_code, 400)
+        self.assertNotIn("db_primary_until", result.headers.get(
+            "Set-Cookie", ""))
+
+    def test_reads_from_pinned_client_skip_the_cache(self):
+        app = self.create_replica_app(cache=True)
+        client = app.test_client()
+        url = "/authors/{}".format(self.test_author_id)
+        with app.app_context():
+            # the replica still has an old version of the author
+            with replica_engines(db.engines)[0].begin() as connection:
+                connection.execute(Author.__table__.insert(), {
+                    "id": self.test_author_id, "names": "Stale",
+                    "lastname": "Replica", "version": 1})
+
+        stale = json.loads(client.get(url).data)["author"]["full_name"]
+        with mock.patch.dict(os.environ, {"RUN_WITH_NO_AUTH": "true"}):
+            client.post("/authors", headers=self.headers,
+                        json=self.test_author)
+        pinned = json.loads(client.get(url).data)["author"]["full_name"]
+        client.cookie_jar.clear()
+        unpinned = json.loads(client.get(url).data)["author"]["full_name"]
+
+        self.assertEqual(stale, "Stale  Replica")
+        self.assertEqual(pinned, "{}  {}".format(
+            self.test_author["names"], self.test_author["lastname"]))
+        self.assertEqual(unpinned, stale)
+        self.assertEqual(app.extensions["response_cache"].hits, 1)
+
+    def test_replicas_round_robin_per_request(self):
+        app = self.create_replica_app(count=2)
+        binds = []
+        for _ in range(2):
+            with app.test_request_context("/articles"):
+                request_binds = [db.session.get_bind() for _ in range(3)]
+                replicas = replica_engines(db.engines)
+            # every read of one request uses the same replica
+            self.assertEqual(len(set(request_binds)), 1)
+            self.assertIn(request_binds[0], replicas)
+            binds.append(request_binds[0])
+        self.assertEqual(set(binds), set(replicas))
+        with app.test_request_context("/articles", method="POST"):
+            self.assertIs(db.session.get_bind(), db.engine)
+        with app.app_context():
+            self.assertIs(db.session.get_bind(), db.engine)
+
     """ End Of Tests """
         
         
@@ -0,0 +1,146 @@
+"""
+Warm-up before a worker takes traffic.
+
+The first requests after a deploy pay for SQLAlchemy mapper configuration,
+opening pool connections and downloading the Auth0 signing keys. warm_up(app)
+does that work up front, then sends one synthetic GET through every read
+route so query compilation and the route code paths are primed as well.
+
+WARMUP=sync (default) runs it inside create_app(), so a gunicorn worker that
+imports app.py is warm before it accepts a connection. The pools are disposed
+afterwards: with gunicorn --preload the master imports app.py and forks the
+workers, which must not share its database sockets. The compiled query cache
+survives, each worker opens its own connections on demand. WARMUP=background
+runs it in a thread and GET /ready answers 503 until it has finished.
+WARMUP=off skips it, the worker is ready at once.
+
+The route GETs are skipped while the schema is missing (DB_CREATE_ALL=false
+before flask db upgrade ran), they could only fail.
+"""
+import os
+import threading
+import time
+from flask import jsonify
+from sqlalchemy import inspect
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.pool import QueuePool
+from auth.auth import AUTH0_DOMAIN, get_jwks
+from cache import SKIP_CACHE
+from database.models import db
+from database.replicas import replica_engines
+
+SKIPPED_ENDPOINTS = ("static", "get_readiness")
+
+
+class WarmupState:
+    def __init__(self):
+        self.ready = False
+        self.steps = {}
+        self.skipped = []
+        self.errors = []
+
+    def run(self, name, step):
+        start = time.perf_counter()
+        try:
+            return step()
+        except Exception as e:
+            self.errors.append(f"{name}: {e}")
+        finally:
+            self.steps[name] = round((time.perf_counter() - start) * 1000, 3)
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "steps_ms": self.steps,
+            "skipped": self.skipped,
+            "errors": self.errors
+        }
+
+
+'''
+open_pool_connections(engine)
+    checks out the pool's configured size at once and returns them, so the
+    pool holds that many open connections
+'''
+def open_pool_connections(engine):
+    size = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+    connections = [engine.connect() for _ in range(size)]
+    for connection in connections:
+        connection.close()
+
+
+def prime_pools(app):
+    with app.app_context():
+        for engine in [db.engine, *replica_engines(db.engines)]:
+            open_pool_connections(engine)
+
+
+def dispose_pools(app):
+    with app.app_context():
+        for engine in [db.engine, *replica_engines(db.engines)]:
+            engine.dispose()
+
+
+def schema_exists(app):
+    with app.app_context():
+        tables = set(inspect(db.engine).get_table_names())
+    return set(db.metadata.tables) <= tables
+
+
+def prefetch_signing_keys():
+    if AUTH0_DOMAIN:
+        get_jwks()
+
+
+'''
+warm_up_routes(app)
+    one GET per read route, path arguments are filled with 0. The requests
+    bypass the response cache so warm-up neither fills nor counts in it,
+    while live requests (WARMUP=background) keep using it.
+'''
+def warm_up_routes(app):
+    client = app.test_client()
+    for rule in app.url_map.iter_rules():
+        if "GET" not in rule.methods or rule.endpoint in SKIPPED_ENDPOINTS:
+            continue
+        client.get(rule.build({arg: 0 for arg in rule.arguments})[1],
+                   environ_base={SKIP_CACHE: True})
+
+
+def warm_up(app):
+    state = app.extensions["warmup"]
+    state.run("mappers", configure_mappers)
+    state.run("pool", lambda: prime_pools(app))
+    state.run("signing_keys", prefetch_signing_keys)
+    if state.run("schema", lambda: schema_exists(app)):
+        state.run("routes", lambda: warm_up_routes(app))
+    else:
+        state.skipped.append("routes")
+    state.ready = True
+    for error in state.errors:
+        app.logger.warning("warm-up %s", error)
+
+
+'''
+init_warmup(app)
+    adds GET /ready and runs warm_up according to WARMUP
+'''
+def init_warmup(app):
+    app.config.setdefault("WARMUP", os.environ.get("WARMUP", "sync"))
+    state = app.extensions["warmup"] = WarmupState()
+
+    @app.route('/ready')
+    def get_readiness():
+        return jsonify({
+            "success": state.ready,
+            **state.stats()
+        }), 200 if state.ready else 503
+
+    mode = app.config["WARMUP"]
+    if mode == "sync":
+        warm_up(app)
+        dispose_pools(app)
+    elif mode == "background":
+        threading.Thread(target=warm_up, args=(app,), daemon=True).start()
+    else:
+        state.ready = True